@@ -0,0 +1,74 @@
+"""Compares the regexes formerly used to parse Markdown files with the scanner that replaced them.
+
+Run with ``python benchmarks/bench_markdown.py`` from the repository root, with notesdir installed.
+"""
+
+import timeit
+
+from notesdir.accessors.markdown import _extract_hashtags, _extract_hrefs, _scan, _split, YAML_META_RE
+
+
+def regexes(doc):
+    body = YAML_META_RE.match(doc).group(4)
+    hrefs = []
+    hashtags = set()
+    for parsable, part in _split(body):
+        if parsable:
+            hrefs.extend(_extract_hrefs(part))
+            hashtags.update(_extract_hashtags(part))
+    return hrefs, hashtags
+
+
+def scanner(doc):
+    return list(_scan(doc))
+
+
+def large_note():
+    section = ('# Heading\n\nSome text with a [link](other.md) and a #hashtag, plus [another][ref].\n\n'
+               '```python\nprint("[not](a-link.md) #not-a-tag")\n```\n\n[ref]: https://example.com\n\n')
+    return '---\ntitle: Large\ntags: [a, b]\n...\n' + section * 2000
+
+
+def typical_note():
+    paragraph = ('Some text with a [link](other.md) and a #hashtag, plus [another][ref]. More words here to pad it out '
+                 'a bit.\n\n')
+    return ('---\ntitle: Typical\n...\n' + paragraph * 40 + '```\ncode\n```\n' + paragraph * 40
+            + '[ref]: https://example.com\n')
+
+
+DOCS = {
+    'typical note': typical_note(),
+    'large note': large_note(),
+    'unterminated fence': '```\n' + 'text [a](b) #c\n' * 2000,
+    'unclosed brackets': '[' * 5000 + '](' + ' ' * 10,
+    'unclosed parens': '[' + '](a' * 20000,
+    'long line': 'x [a] ' * 20000,
+    'unterminated metadata': '---\n' + 'key: value\n' * 20000,
+}
+
+# Functions that build documents of a given size, for checking that the scanner's time grows linearly with it
+SCALING = {
+    'brackets before a link': lambda n: '[x ' * n + '](y',
+    'links without spaces': lambda n: '[a](b)' * n,
+    'unclosed brackets': lambda n: '[' * n + '](',
+    'refstyle hrefs': lambda n: '[a]: b\n' * n,
+}
+
+
+def _time(func, doc):
+    number, total = timeit.Timer(lambda: func(doc)).autorange()
+    return total / number
+
+
+def main():
+    for name, doc in DOCS.items():
+        for func in (regexes, scanner):
+            print(f'{name:<25} {func.__name__:<10} {_time(func, doc) * 1000:10.2f} ms')
+    for name, make_doc in SCALING.items():
+        times = [_time(scanner, make_doc(n)) for n in (10000, 20000, 40000)]
+        print(f'{name:<25} scanner    ' + ' '.join(f'{t * 1000:8.2f} ms' for t in times)
+              + f'  (n = 10k, 20k, 40k)')
+
+
+if __name__ == '__main__':
+    main()
@@ -33,5 +33,8 @@ setuptools.setup(
         'shortuuid',
         'terminaltables',
     ],
+    extras_require={
+        'watch': ['watchdog'],
+    },
     python_requires='>=3.7',
 )
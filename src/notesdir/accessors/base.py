@@ -3,9 +3,10 @@
 The most important class is :class:`Accessor`.
 """
 
-from typing import List
+from typing import List, Optional
 
-from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, ReplaceHrefCmd, SetCreatedCmd, SetTitleCmd
+from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, ReplaceHrefCmd, ReplaceHrefsCmd,\
+    SetCreatedCmd, SetTitleCmd, FileInfoReq, FileInfoReqIsh
 
 
 class ParseError(Exception):
@@ -15,6 +16,10 @@ class ParseError(Exception):
         self.path = path
         self.cause = cause
 
+    def __reduce__(self):
+        # Allows instances to be passed back from worker processes
+        return ParseError, (self.message, self.path, self.cause)
+
 
 class ChangeError(Exception):
     """Raised when an :class:`Accessor` is unable to perform a requested change."""
@@ -62,7 +67,7 @@ class Accessor:
             raise e
         self._loaded = True
 
-    def info(self) -> FileInfo:
+    def info(self, fields: FileInfoReqIsh = None) -> FileInfo:
         """Returns details about the file.
 
         This will not necessarily reload the file from disk if the instance has previously loaded it.
@@ -70,14 +75,30 @@ class Accessor:
         This will only populate the attributes of FileInfo that are supported by the particular subclass, and
         also will not populate any attributes (such as backlinks) that cannot be derived from the file in isolation.
 
+        If ``fields`` is given, attributes that were not requested may be left unpopulated. Some subclasses use
+        this to avoid reading or parsing the whole file.
+
         May raise :exc:`ParseError`.
         """
+        info = FileInfo(self.path)
         if not self._loaded:
+            if fields is not None and self._partial_info(info, FileInfoReq.parse(fields)):
+                return info
             self.load()
-        info = FileInfo(self.path)
         self._info(info)
         return info
 
+    def text(self) -> Optional[str]:
+        """Returns the searchable text content of the file, or None if the file type does not support this.
+
+        Metadata such as the title is not necessarily included.
+
+        May raise :exc:`ParseError`.
+        """
+        if not self._loaded:
+            self.load()
+        return self._text()
+
     def edit(self, edit: FileEditCmd) -> None:
         """Applies the given change to this instance (but does not save it to the file yet).
 
@@ -100,7 +121,11 @@ class Accessor:
             self._del_tag(edit)
         elif isinstance(edit, ReplaceHrefCmd):
             if not edit.original == edit.replacement:
-                self._replace_href(edit)
+                self._replace_hrefs(ReplaceHrefsCmd(edit.path, {edit.original: edit.replacement}))
+        elif isinstance(edit, ReplaceHrefsCmd):
+            replacements = {o: r for o, r in edit.replacements.items() if not o == r}
+            if replacements:
+                self._replace_hrefs(ReplaceHrefsCmd(edit.path, replacements))
         elif isinstance(edit, SetCreatedCmd):
             self._set_created(edit)
         elif isinstance(edit, SetTitleCmd):
@@ -137,6 +162,21 @@ class Accessor:
         """
         raise NotImplementedError()
 
+    def _partial_info(self, info: FileInfo, fields: FileInfoReq) -> bool:
+        """Subclasses may override this to populate the requested attributes of the info without a full load.
+
+        This is only called if :meth:`load` has not been called yet. It should return False, without changing the
+        info, if it cannot handle the request more cheaply than a full load; :meth:`info` will then do a full load.
+        """
+        return False
+
+    def _text(self) -> Optional[str]:
+        """Subclasses should override this to support :meth:`text`.
+
+        The base class will ensure :meth:`load` has been called.
+        """
+        return None
+
     def _save(self) -> None:
         """Subclasses should override this instead of :meth:`save`.
 
@@ -172,11 +212,13 @@ class Accessor:
         """
         raise UnsupportedChangeError(edit)
 
-    def _replace_href(self, edit: ReplaceHrefCmd):
-        """Subclasses should override this to support :class:`ReplaceRefCmd` edits.
+    def _replace_hrefs(self, edit: ReplaceHrefsCmd):
+        """Subclasses should override this to support :class:`ReplaceHrefsCmd` and :class:`ReplaceHrefCmd` edits.
 
-        The subclass should set :attr:`self.edited` to True if :attr:`edit.original` exists in the file.
-        The base class will ensure this method is not called if :attr:`edit.original` == :attr:`edit.replacement`.
+        The base class passes a :class:`ReplaceHrefCmd` to this method as a :class:`ReplaceHrefsCmd` with one item.
+        The subclass should set :attr:`self.edited` to True if any of the original values exist in the file.
+        The base class will remove any items whose original value is the same as their replacement, and will ensure
+        this method is not called if none remain.
         """
         raise UnsupportedChangeError(edit)
 
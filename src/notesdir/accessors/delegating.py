@@ -1,10 +1,9 @@
 """Provides the :class:`DelegatingAccessor` class."""
 
+from typing import Optional
+
 from notesdir.accessors.base import Accessor, MiscAccessor
-from notesdir.models import FileInfo, FileEditCmd
-from notesdir.accessors.html import HTMLAccessor
-from notesdir.accessors.markdown import MarkdownAccessor
-from notesdir.accessors.pdf import PDFAccessor
+from notesdir.models import FileInfo, FileEditCmd, FileInfoReqIsh
 
 
 class DelegatingAccessor(Accessor):
@@ -18,14 +17,20 @@ class DelegatingAccessor(Accessor):
     * ``.html`` -> :class:`HTMLAccessor`
     * ``.pdf`` -> :class:`PDFAccessor`
     * anything else -> :class:`MiscAccessor`
+
+    The modules for each accessor, and the libraries they use, are only imported once a file of that type is
+    encountered.
     """
     def __init__(self, path: str):
         super().__init__(path)
         if path.endswith('.md'):
+            from notesdir.accessors.markdown import MarkdownAccessor
             self.accessor = MarkdownAccessor(path)
         elif path.endswith('.html'):
+            from notesdir.accessors.html import HTMLAccessor
             self.accessor = HTMLAccessor(path)
         elif path.endswith('.pdf'):
+            from notesdir.accessors.pdf import PDFAccessor
             self.accessor = PDFAccessor(path)
         else:
             self.accessor = MiscAccessor(path)
@@ -33,8 +38,11 @@ class DelegatingAccessor(Accessor):
     def load(self):
         self.accessor.load()
 
-    def info(self) -> FileInfo:
-        return self.accessor.info()
+    def info(self, fields: FileInfoReqIsh = None) -> FileInfo:
+        return self.accessor.info(fields)
+
+    def text(self) -> Optional[str]:
+        return self.accessor.text()
 
     def edit(self, edit: FileEditCmd):
         self.accessor.edit(edit)
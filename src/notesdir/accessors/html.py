@@ -4,14 +4,31 @@ from collections import defaultdict
 from datetime import datetime
 from typing import Set
 
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, Comment, Tag
 
 from notesdir.accessors.base import Accessor, ChangeError, ParseError
-from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd,\
-    LinkInfo
+from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, SetTitleCmd, SetCreatedCmd,\
+    ReplaceHrefsCmd, LinkInfo, FileInfoReq
 
 _DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
 
+_HEAD_END = '</head>'
+
+
+def _read_head(file) -> str:
+    """Reads the file up to and including the end of the ``<head>`` element, or the whole file if there is none."""
+    text = ''
+    while True:
+        chunk = file.read(8192)
+        if not chunk:
+            return text
+        # Search from slightly before the new chunk in case the end tag spans two chunks
+        start = max(0, len(text) - len(_HEAD_END))
+        text += chunk
+        index = text[start:].lower().find(_HEAD_END)
+        if index >= 0:
+            return text[:start + index + len(_HEAD_END)]
+
 
 class HTMLAccessor(Accessor):
     """Responsible for parsing and updating HTML files.
@@ -23,6 +40,7 @@ class HTMLAccessor(Accessor):
     * Tags are stored in the ``<meta name="keywords">`` element's ``content`` attribute, comma-separated.
     * Links can be recognized and updated when they are in the ``a``, ``img``, ``video``, ``audio``, or ``source``
       elements. Note that the ``srcset`` attribute is not currently supported.
+    * The searchable text is the visible text of the ``<body>`` element.
 
     If the file does not at least contain an ``<html>`` element, attempting to add metadata will fail.
 
@@ -30,13 +48,7 @@ class HTMLAccessor(Accessor):
     """
     def _load(self):
         with open(self.path, 'r') as file:
-            try:
-                self._page = BeautifulSoup(file, 'lxml')
-            except Exception as e:
-                raise ParseError('Cannot parse HTML', self.path, e)
-        self._title_el = self._page.find('title')
-        self._keywords_el = self._page.find('meta', {'name': 'keywords'})
-        self._created_el = self._page.find('meta', {'name': 'created'})
+            self._parse(file)
         self._link_els = defaultdict(list)
         for a_el in self._page.find_all('a'):
             href = a_el.attrs.get('href', None)
@@ -50,12 +62,38 @@ class HTMLAccessor(Accessor):
         self._head_el = None
         self._html_el = None
 
+    def _parse(self, markup) -> None:
+        try:
+            self._page = BeautifulSoup(markup, 'lxml')
+        except Exception as e:
+            raise ParseError('Cannot parse HTML', self.path, e)
+        self._title_el = self._page.find('title')
+        self._keywords_el = self._page.find('meta', {'name': 'keywords'})
+        self._created_el = self._page.find('meta', {'name': 'created'})
+
+    def _partial_info(self, info: FileInfo, fields: FileInfoReq) -> bool:
+        if fields.links:
+            return False
+        # All the metadata lives in the <head>, so the body does not need to be parsed
+        with open(self.path, 'r') as file:
+            self._parse(_read_head(file))
+        info.title = self._title()
+        info.created = self._created()
+        info.tags = self._tags()
+        return True
+
     def _info(self, info: FileInfo):
         info.title = self._title()
         info.created = self._created()
         info.tags = self._tags()
         info.links = [LinkInfo(self.path, href) for href in sorted(self._link_els.keys())]
 
+    def _text(self) -> str:
+        root = self._page.find('body') or self._page
+        strings = (s.strip() for s in root.find_all(string=True)
+                   if not (isinstance(s, Comment) or s.parent.name in ('script', 'style')))
+        return ' '.join(s for s in strings if s)
+
     def _save(self):
         with open(self.path, 'w') as file:
             file.write(str(self._page))
@@ -131,12 +169,12 @@ class HTMLAccessor(Accessor):
             self._created_el = newel
         self._created_el['content'] = edit.value.strftime(_DATE_FORMAT)
 
-    def _replace_href(self, edit: ReplaceHrefCmd):
-        if edit.original not in self._link_els:
-            return False
-        self.edited = True
-        for link_el in self._link_els[edit.original]:
-            if link_el.attrs.get('href', None) == edit.original:
-                link_el.attrs['href'] = edit.replacement
-            if link_el.attrs.get('src', None) == edit.original:
-                link_el.attrs['src'] = edit.replacement
+    def _replace_hrefs(self, edit: ReplaceHrefsCmd):
+        # An element may have both an href and a src, so make sure each element is only updated once
+        link_els = {id(el): el for original in edit.replacements for el in self._link_els.get(original, [])}
+        for link_el in link_els.values():
+            self.edited = True
+            for attr in ('href', 'src'):
+                replacement = edit.replacements.get(link_el.attrs.get(attr, None))
+                if replacement is not None:
+                    link_el.attrs[attr] = replacement
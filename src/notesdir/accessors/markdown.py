@@ -1,11 +1,13 @@
-import re
+from collections import namedtuple
 from io import StringIO
-from typing import Set, Tuple, List
+import re
+from typing import Iterator, List, Optional, Set, Tuple
 
 import yaml
 
 from notesdir.accessors.base import Accessor
-from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, LinkInfo
+from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefsCmd, LinkInfo,\
+    FileInfoReq
 
 YAML_META_RE = re.compile(r'(?ms)(\A---\n(.*?)\n(---|\.\.\.)\s*\r?\n)?(.*)')
 TAG_RE = re.compile(r'(\s|^)#([a-zA-Z][a-zA-Z\-_0-9]*)\b')
@@ -23,40 +25,30 @@ def _extract_meta(doc) -> Tuple[dict, str]:
     return meta, body
 
 
-def _extract_hashtags(doc) -> Set[str]:
-    return {t[1].lower() for t in TAG_RE.findall(doc)}
+def _read_meta_block(file) -> str:
+    """Reads just enough of the file to include the whole YAML metadata header, if it has one.
 
+    Passing the result to :func:`_scan_meta` gives the same metadata as passing the whole file would.
+    """
+    lines = [file.readline()]
+    if not lines[0] == '---\n':
+        return lines[0]
+    for line in file:
+        lines.append(line)
+        # YAML_META_RE requires at least one line (possibly empty) between the delimiters
+        if len(lines) > 2 and line.endswith('\n') and line.rstrip() in ('---', '...'):
+            break
+    return ''.join(lines)
 
-def _remove_hashtag(doc: str, tag: str) -> str:
-    # TODO probably would be better to build a customized regex like replace_ref does
-    def replace(match):
-        if match.group(2).lower() == tag:
-            return match.group(1)
-        else:
-            return match.group(0)
-    return re.sub(TAG_RE, replace, doc)
+
+def _extract_hashtags(doc) -> Set[str]:
+    return {t[1].lower() for t in TAG_RE.findall(doc)}
 
 
 def _extract_hrefs(doc) -> List[str]:
     return INLINE_HREF_RE.findall(doc) + REFSTYLE_HREF_RE.findall(doc)
 
 
-def _replace_href(doc: str, src: str, dest: str) -> str:
-    escaped_src = re.escape(src)
-
-    def inline_replacement(match):
-        return f'{match.group(1)}({dest})'
-
-    def refstyle_replacement(match):
-        return f'{match.group(1)}{dest}{match.group(2)}'
-
-    inline = rf'(\[.*\])\({escaped_src}\)'
-    doc = re.sub(inline, inline_replacement, doc)
-    refstyle = rf'(?m)(^\[.*\]:\s*){escaped_src}(\s|$)'
-    doc = re.sub(refstyle, refstyle_replacement, doc)
-    return doc
-
-
 def _split(doc: str) -> List[Tuple[bool, str]]:
     result = []
     prev = 0
@@ -69,6 +61,208 @@ def _split(doc: str) -> List[Tuple[bool, str]]:
     return result
 
 
+# The functions below scan a document in linear time, giving the same results as the regexes above would.
+# (INLINE_HREF_RE and FENCED_CODE_RE can take quadratic time, for example on long lines containing many brackets.)
+
+_META = 'meta'
+_CODE = 'code'
+_HREF = 'href'
+_HASHTAG = 'hashtag'
+
+_Token = namedtuple('_Token', ['kind', 'start', 'end', 'value'])
+"""A piece of a Markdown document found by :func:`_scan`.
+
+``start`` and ``end`` are offsets into the document. For hrefs and hashtags they cover just the href or the
+hashtag's name (without the ``#``), which is also the ``value``. For the metadata block, the ``value`` is the YAML
+text, and for code blocks it is None.
+"""
+
+_WHITESPACE_RE = re.compile(r'\s*')
+_NON_WHITESPACE_RE = re.compile(r'\S*')
+_HREF_PREFIX_RE = re.compile(r'(?:\S[^\s)]*)?')
+# Unlike FENCED_CODE_RE, this only allows whitespace within the line, so it cannot backtrack across many lines
+_FENCE_RE = re.compile(r'(?m)^[^\S\n]*```')
+
+
+def _scan_meta(doc: str) -> Optional[_Token]:
+    """Finds the metadata block at the start of the document, like YAML_META_RE."""
+    if not doc.startswith('---\n'):
+        return None
+    # The newline ending each line of the metadata; there must be at least one line, though it may be empty
+    newline = doc.find('\n', 4)
+    while newline >= 0:
+        delimiter = newline + 1
+        if doc.startswith(('---', '...'), delimiter):
+            whitespace_end = _WHITESPACE_RE.match(doc, delimiter + 3).end()
+            last_newline = doc.rfind('\n', delimiter + 3, whitespace_end)
+            if last_newline >= 0:
+                return _Token(_META, 0, last_newline + 1, doc[4:newline])
+        newline = doc.find('\n', delimiter)
+    return None
+
+
+def _block_start(doc: str, fence_line: int, pos: int) -> int:
+    """Returns where FENCED_CODE_RE's match would begin, if its search started at ``pos``.
+
+    Like the regex, a block's span begins at the start of the first of any blank lines before the opening fence.
+    """
+    start = fence_line
+    while start > pos and doc[start - 1].isspace():
+        start -= 1
+    if start > pos or not (pos == 0 or doc[pos - 1] == '\n'):
+        start = doc.find('\n', start, fence_line) + 1 or fence_line
+    return start
+
+
+def _inline_href(doc: str, bracket: int, line_end: int) -> Optional[Tuple[int, int]]:
+    """Returns the start and end of the href INLINE_HREF_RE would match from the given opening bracket, if any.
+
+    This only looks at the text after the bracket up to the end of the match, or the end of the line if there is no
+    match, so as long as it is called with brackets after the end of the previous match, each character of a line
+    is examined a constant number of times.
+    """
+    close = doc.find('](', bracket + 1, line_end)
+    while close >= 0:
+        href_start = close + 2
+        # Stops at the first ) after the href's first character, which is where (\S+?)\) would stop
+        href_end = _HREF_PREFIX_RE.match(doc, href_start, line_end).end()
+        if href_end > href_start and doc.startswith(')', href_end):
+            return href_start, href_end
+        # Any other closing bracket before the end of the href would have to use the same (unclosed) href
+        close = doc.find('](', max(close + 1, href_end), line_end)
+    return None
+
+
+def _insert(tokens: List[_Token], token: _Token) -> None:
+    """Inserts the token into the list, which is sorted by start offset, and very short."""
+    i = len(tokens)
+    while i and tokens[i - 1].start > token.start:
+        i -= 1
+    tokens.insert(i, token)
+
+
+# Finds the places where a token may begin: a bracket, a hashtag (group 1, the name), or a newline followed by an
+# opening fence (group 2, the fence's line). Every alternative begins with a literal character, which lets the regex
+# engine skip quickly to the next candidate, and none of them looks further than the token it finds. (?<!\S#) works
+# like TAG_RE's (\s|^) except at the start of text following a code block, which _scan checks separately.
+_EVENT_RE = re.compile(r'\[|#(?<!\S#)([a-zA-Z][a-zA-Z\-_0-9]*)\b|\n([^\S\n]*```)')
+_TAG_NAME_RE = re.compile(r'[a-zA-Z][a-zA-Z\-_0-9]*\b')
+
+
+def _scan(doc: str) -> Iterator[_Token]:
+    """Yields the metadata block, code blocks, hrefs and hashtags in the document, in order of their start offsets.
+
+    Hrefs and hashtags inside code blocks are skipped.
+
+    This is a single pass over the document. Tokens of different kinds can overlap (for example, a hashtag can be
+    inside a link's text), so an href is held back until the scan has passed its start.
+    """
+    length = len(doc)
+    meta = _scan_meta(doc)
+    pos = 0
+    if meta:
+        yield meta
+        pos = meta.end
+    # Start of the text since the last code block; like the regexes, which were run on the text between code blocks,
+    # _scan treats this as the start of a line
+    text_start = pos
+    # Positions before which inline and refstyle hrefs cannot begin, because of earlier matches or failures
+    inline_resume = refstyle_resume = pos
+    # Maps the positions of opening fences to the ends of their closing fences, or None if there are none
+    closings = {}
+    # Set once an opening fence without a closing fence is found, since any later fences would be unclosed too
+    unclosed = False
+    # Hrefs found ahead of the current position, in order
+    pending = []
+    search = _EVENT_RE.search
+    # End of the line containing the most recent bracket
+    line_end = -1
+
+    while True:
+        fence_line = None
+        if pos == text_start:
+            if pos == 0 or doc[pos - 1] == '\n':
+                if _FENCE_RE.match(doc, pos):
+                    fence_line = pos
+            elif doc.startswith('#', pos):
+                name = _TAG_NAME_RE.match(doc, pos + 1)
+                if name:
+                    yield _Token(_HASHTAG, pos + 1, name.end(), name.group())
+        event = None
+        if fence_line is None:
+            event = search(doc, pos)
+            if not event:
+                yield from pending
+                return
+            event_start = event.start()
+            # Tokens found from this event will start after it
+            while pending and pending[0].start <= event_start:
+                yield pending.pop(0)
+            group = event.lastindex
+            if group == 1:
+                # Any pending href starts after the name's first character, so the hashtag comes first
+                pos = event.end()
+                yield _Token(_HASHTAG, event_start + 1, pos, event.group(1))
+                continue
+            if group == 2:
+                fence_line = event_start + 1
+
+        if fence_line is not None:
+            fence = _FENCE_RE.match(doc, fence_line).end() - 3
+            end = None
+            if not unclosed:
+                if fence not in closings:
+                    closing = _FENCE_RE.search(doc, fence + 3)
+                    closings[fence] = closing and closing.end()
+                    unclosed = not closing
+                end = closings[fence]
+            if end is None:
+                pos = fence + 3
+                continue
+            yield from pending
+            pending.clear()
+            yield _Token(_CODE, _block_start(doc, fence_line, text_start), end, None)
+            pos = text_start = inline_resume = refstyle_resume = end
+            continue
+
+        bracket = event_start
+        if bracket > line_end:
+            line_end = doc.find('\n', bracket)
+            if line_end < 0:
+                line_end = length
+        if bracket >= inline_resume:
+            span = _inline_href(doc, bracket, line_end)
+            if span:
+                href_start, href_end = span
+                token = _Token(_HREF, href_start, href_end, doc[href_start:href_end])
+                if pending:
+                    _insert(pending, token)
+                else:
+                    pending.append(token)
+                inline_resume = href_end + 1
+            else:
+                # Later brackets on this line would be followed by the same (unusable) closing brackets
+                inline_resume = line_end + 1
+        if (bracket == text_start or doc[bracket - 1] == '\n') and bracket >= refstyle_resume:
+            colon = doc.find(']:', bracket + 1, line_end)
+            if colon >= 0:
+                href_start = _WHITESPACE_RE.match(doc, colon + 2).end()
+                # Like the regex, the href may be on a following line, but not in a following code block
+                in_code = False
+                if href_start < length and doc.startswith('```', href_start) and not unclosed\
+                        and doc.find('\n', colon, href_start) >= 0:
+                    if href_start not in closings:
+                        closing = _FENCE_RE.search(doc, href_start + 3)
+                        closings[href_start] = closing and closing.end()
+                        unclosed = not closing
+                    in_code = closings[href_start] is not None
+                if href_start < length and not in_code:
+                    href_end = _NON_WHITESPACE_RE.match(doc, href_start).end()
+                    _insert(pending, _Token(_HREF, href_start, href_end, doc[href_start:href_end]))
+                    refstyle_resume = href_end
+        pos = bracket + 1
+
+
 class MarkdownAccessor(Accessor):
     """Responsible for parsing and updating Markdown files.
 
@@ -86,8 +280,9 @@ class MarkdownAccessor(Accessor):
         * ``![any image title](HREF)``
         * (at beginning of a line) ``[any id]: HREF optional text``
 
-    Currently, parsing and updating is done via regex, so formatting changes should be minimal but false positives
-    for links and hashtags are a risk.
+    Currently, parsing is done with simple pattern matching, and updating only rewrites the text of the affected
+    links, hashtags, or metadata header, so formatting changes should be minimal but false positives for links and
+    hashtags are a risk.
 
     Here's an example Markdown file with metadata and hashtags:
 
@@ -106,25 +301,66 @@ class MarkdownAccessor(Accessor):
     """
     def _load(self):
         with open(self.path, 'r') as file:
-            text = file.read()
-        self.meta, body = _extract_meta(text)
-        self.parts = _split(body)
-        self.hrefs = []
-        self._hashtags = set()
-        for parsable, part in self.parts:
-            if parsable:
-                self.hrefs.extend(_extract_hrefs(part))
-                self._hashtags.update(_extract_hashtags(part))
+            self._doc = file.read()
+        self.meta = {}
+        self._body_start = 0
+        self._hrefs = []
+        self._hashtags = []
+        for token in _scan(self._doc):
+            if token.kind == _META:
+                if token.value:
+                    self.meta = yaml.safe_load(token.value)
+                self._body_start = token.end
+            elif token.kind == _HREF:
+                self._hrefs.append(token)
+            elif token.kind == _HASHTAG:
+                self._hashtags.append(token)
+        self.hrefs = [t.value for t in self._hrefs]
+        self._meta_edited = False
+        # Maps (start, end) offsets in the document to the text that should replace that range when saving
+        self._splices = {}
+
+    def _partial_info(self, info: FileInfo, fields: FileInfoReq) -> bool:
+        if fields.tags or fields.links:
+            return False
+        # The title and created date come from the metadata header, so the body does not need to be read
+        with open(self.path, 'r') as file:
+            meta = _scan_meta(_read_meta_block(file))
+        meta = yaml.safe_load(meta.value) if meta and meta.value else {}
+        info.title = meta.get('title')
+        info.created = meta.get('created')
+        return True
 
     def _info(self, info: FileInfo):
         info.title = self.meta.get('title')
         info.created = self.meta.get('created')
-        info.tags = {k.lower() for k in self.meta.get('keywords', [])}.union(self._hashtags)
+        info.tags = {k.lower() for k in self.meta.get('keywords', [])}.union(self._hashtag_names())
         info.links = [LinkInfo(self.path, r) for r in sorted(self.hrefs)]
 
+    def _hashtag_names(self) -> Set[str]:
+        return {t.value.lower() for t in self._hashtags if (t.start - 1, t.end) not in self._splices}
+
+    def _body(self) -> str:
+        chunks = []
+        prev = self._body_start
+        for start, end in sorted(self._splices):
+            # Overlapping splices can only come from a refstyle href that is also a hashtag; keep the first
+            if start < prev:
+                continue
+            chunks.append(self._doc[prev:start])
+            chunks.append(self._splices[(start, end)])
+            prev = end
+        chunks.append(self._doc[prev:])
+        return ''.join(chunks)
+
+    def _text(self) -> str:
+        return self._body()
+
     def _save(self):
-        body = ''.join(part for _, part in self.parts)
-        if self.meta:
+        body = self._body()
+        if not self._meta_edited:
+            text = self._doc[:self._body_start] + body
+        elif self.meta:
             sio = StringIO()
             yaml.safe_dump(self.meta, sio)
             # include a blank line between metadata and body
@@ -133,12 +369,16 @@ class MarkdownAccessor(Accessor):
             text = body
         with open(self.path, 'w') as file:
             file.write(text)
+        # The offsets recorded by _load no longer apply, so reload before any further edits
+        self._loaded = False
 
     def _add_tag(self, edit: AddTagCmd):
         tag = edit.value.lower()
         # TODO probably isn't great that this will duplicate a tag into the keywords when it's
         #      already in the body as a hashtag
-        self.edited = self.edited or tag not in self.meta.get('keywords', [])
+        if tag not in self.meta.get('keywords', []):
+            self.edited = True
+            self._meta_edited = True
         if 'keywords' in self.meta:
             self.meta['keywords'].append(tag)
             self.meta['keywords'].sort()
@@ -153,27 +393,30 @@ class MarkdownAccessor(Accessor):
             else:
                 self.meta['keywords'].remove(tag)
             self.edited = True
-        if tag in self._hashtags:
-            for i in range(len(self.parts)):
-                parsable, part = self.parts[i]
-                if parsable:
-                    self.parts[i] = (True, _remove_hashtag(part, tag))
-            self._hashtags.remove(tag)
-            self.edited = True
+            self._meta_edited = True
+        for token in self._hashtags:
+            # Remove the # along with the name
+            span = (token.start - 1, token.end)
+            if token.value.lower() == tag and span not in self._splices:
+                self._splices[span] = ''
+                self.edited = True
 
     def _set_title(self, edit: SetTitleCmd):
-        self.edited = self.edited or not self.meta.get('title') == edit.value
+        if not self.meta.get('title') == edit.value:
+            self.edited = True
+            self._meta_edited = True
         self.meta['title'] = edit.value
 
     def _set_created(self, edit: SetCreatedCmd):
-        self.edited = self.edited or not self.meta.get('created') == edit.value
+        if not self.meta.get('created') == edit.value:
+            self.edited = True
+            self._meta_edited = True
         self.meta['created'] = edit.value
 
-    def _replace_href(self, edit: ReplaceHrefCmd):
-        if edit.original not in self.hrefs:
-            return
-        self.edited = True
-        for i in range(len(self.parts)):
-            parsable, part = self.parts[i]
-            if parsable:
-                self.parts[i] = (True, _replace_href(part, edit.original, edit.replacement))
+    def _replace_hrefs(self, edit: ReplaceHrefsCmd):
+        for i, token in enumerate(self._hrefs):
+            replacement = edit.replacements.get(self.hrefs[i])
+            if replacement is not None:
+                self._splices[(token.start, token.end)] = replacement
+                self.hrefs[i] = replacement
+                self.edited = True
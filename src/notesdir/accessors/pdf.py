@@ -54,6 +54,8 @@ class PDFAccessor(Accessor):
         * ``/Keywords`` (comma-separated)
     * Links are *not* currently supported, so although notesdir can update links to PDF files from other files,
       it will not currently update links from PDF files to other files.
+    * The searchable text is whatever text PyPDF4 can extract from the pages, which may be incomplete or garbled
+      for some documents.
 
     PyPDF4 is used for parsing and updating.
 
@@ -74,6 +76,16 @@ class PDFAccessor(Accessor):
             except Exception as e:
                 raise ParseError('Cannot parse PDF', self.path, e)
 
+    def _text(self) -> str:
+        with open(self.path, 'rb') as file:
+            try:
+                pdf = PdfFileReader(file)
+                if pdf.isEncrypted:
+                    pdf.decrypt('')
+                return '\n'.join(pdf.getPage(i).extractText() for i in range(pdf.getNumPages()))
+            except Exception as e:
+                raise ParseError('Cannot extract text from PDF', self.path, e)
+
     def _tags(self):
         split = (t.strip() for t in self._meta.get('/Keywords', '').lower().split(','))
         return {t for t in split if t}
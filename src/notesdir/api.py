@@ -1,13 +1,13 @@
 """Provides the main entry point for using the library, :class:`Notesdir`"""
 
 from __future__ import annotations
+from collections import defaultdict
 from dataclasses import replace
 from datetime import datetime
 from glob import glob
 import os.path
 import re
 from typing import Dict, Set, Optional, List
-from mako.template import Template
 from notesdir.conf import NotesdirConf
 from notesdir.models import AddTagCmd, DelTagCmd, SetTitleCmd, SetCreatedCmd, FileInfoReq, TemplateDirectives,\
     DependentPathFn, FileInfo, MoveCmd, CreateCmd
@@ -68,10 +68,12 @@ class Notesdir:
         refer to actual files.
         """
         info = self.repo.info(original, FileInfoReq(path=True, backlinks=True))
-        edits = []
+        hrefs_by_referrer = defaultdict(set)
         for link in info.backlinks:
-            # TODO group links from the same referrer for this call
-            edits.extend(edits_for_path_replacement(link.referrer, {link.href}, replacement))
+            hrefs_by_referrer[link.referrer].add(link.href)
+        edits = []
+        for referrer, hrefs in hrefs_by_referrer.items():
+            edits.extend(edits_for_path_replacement(referrer, hrefs, replacement))
         if edits:
             self.repo.change(edits)
 
@@ -272,6 +274,7 @@ class Notesdir:
         template_path = self.template_for_name(template_name)
         if not (template_path and os.path.isfile(template_path)):
             raise FileNotFoundError(f'Template does not exist: {template_name}')
+        from mako.template import Template
         template = Template(filename=os.path.abspath(template_path))
         td = TemplateDirectives(dest=dest if dest is not None else None)
         content = template.render(nd=self, directives=td, template_path=template_path)
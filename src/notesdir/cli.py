@@ -4,13 +4,18 @@
 import argparse
 import dataclasses
 from datetime import datetime
+from functools import partial
 import json
+import math
 from operator import itemgetter, attrgetter
 import os.path
 import sys
-from terminaltables import AsciiTable
+from typing import List
 from notesdir.api import Notesdir
-from notesdir.models import FileInfoReq, FileInfo
+from notesdir.conf import SqliteRepoConf
+from notesdir.models import FileInfoReq, FileInfo, FileQuery
+from notesdir.repos.sqlite import SqliteRepo
+from notesdir.server import default_socket_path, forward, serve
 
 
 def _print_file_info(info: FileInfo, fields: FileInfoReq, nd: Notesdir) -> None:
@@ -40,7 +45,7 @@ def _info(args, nd: Notesdir) -> int:
     fields = FileInfoReq.parse(args.fields[0]) if args.fields else FileInfoReq.full()
     info = nd.repo.info(args.path[0], fields)
     if args.json:
-        print(json.dumps(info.as_json()))
+        print(json.dumps(info.as_json(fields)))
     else:
         _print_file_info(info, fields, nd)
     return 0
@@ -102,6 +107,7 @@ def _tags(args, nd: Notesdir) -> int:
     else:
         tags = sorted(counts.keys())
         data = [('Tag', 'Count')] + [(t, counts[t]) for t in tags]
+        from terminaltables import AsciiTable
         table = AsciiTable(data)
         table.justify_columns[2] = 'right'
         print(table.table)
@@ -115,14 +121,24 @@ def _relink(args, nd: Notesdir) -> int:
 
 def _query(args, nd: Notesdir) -> int:
     query = args.query or ''
-    infos = [i for i in nd.repo.query(query) if os.path.isfile(i.path)]
     if args.fields:
         fields = FileInfoReq.parse(args.fields[0])
+    elif args.json or args.ndjson:
+        fields = FileInfoReq.internal()
     else:
         fields = FileInfoReq(path=True, tags=True, title=True, created=True)
+    # Only the requested fields are loaded, so JSON output leaves out the rest rather than showing them as empty
+    json_fields = fields if args.fields else None
+    infos = (i for i in nd.repo.query(query, fields) if os.path.isfile(i.path))
+    if args.ndjson:
+        # Results are written as they arrive, in the order the query specifies (or the repo's own order)
+        for info in infos:
+            print(json.dumps(info.as_json(json_fields)))
+        return 0
+    infos = list(infos)
     if args.json:
         infos.sort(key=attrgetter('path'))
-        print(json.dumps([i.as_json() for i in infos]))
+        print(json.dumps([i.as_json(json_fields) for i in infos]))
     elif args.table:
         # TODO make sorting / path resolution consistent with json output
         data = []
@@ -156,6 +172,7 @@ def _query(args, nd: Notesdir) -> int:
         if fields.backlinks:
             heading += ('Backlink paths',)
         data.insert(0, heading)
+        from terminaltables import AsciiTable
         table = AsciiTable(data)
         print(table.table)
     else:
@@ -165,11 +182,93 @@ def _query(args, nd: Notesdir) -> int:
     return 0
 
 
+def _search(args, nd: Notesdir) -> int:
+    query = FileQuery.parse(args.query or '')
+    query.include_text.extend(args.text)
+    results = nd.repo.search(query, FileInfoReq(path=True, title=True))
+    if args.json:
+        print(json.dumps([{'path': info.path, 'title': info.title, 'snippet': snippet}
+                          for info, snippet in results]))
+    else:
+        for info, snippet in results:
+            print('--------------------')
+            print(f'path: {nd.conf.cli_path_output_rewriter(info.path)}')
+            if info.title:
+                print(f'title: {info.title}')
+            if snippet:
+                print(' '.join(snippet.split()))
+    return 0
+
+
+def _index(args, nd: Notesdir) -> int:
+    if not isinstance(nd.repo, SqliteRepo):
+        print('The index command requires conf.repo_conf to be a SqliteRepoConf.', file=sys.stderr)
+        return 1
+    if args.rebuild:
+        nd.repo.rebuild()
+    else:
+        nd.repo.refresh()
+    return 0
+
+
+def _watch(args, nd: Notesdir) -> int:
+    if not isinstance(nd.repo, SqliteRepo):
+        print('The watch command requires conf.repo_conf to be a SqliteRepoConf.', file=sys.stderr)
+        return 1
+    from notesdir.watch import watch
+    try:
+        watch(nd.repo, debounce=args.debounce)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _serve(args, nd: Notesdir) -> int:
+    try:
+        serve(args.socket or default_socket_path(), partial(_run_forwarded, nd))
+    except FileExistsError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _run_forwarded(nd: Notesdir, argv: List[str]) -> int:
+    parser = argparser()
+    args = parser.parse_args(argv)
+    if not args.func:
+        parser.print_help()
+        return 1
+    if args.local:
+        print('This command cannot be run by the server.', file=sys.stderr)
+        return 1
+    preview_mode = nd.repo.conf.preview_mode
+    if args.preview:
+        nd.repo.conf.preview_mode = True
+    try:
+        # Behave like a new instance would, since the server's instance may have been open for a long time
+        if isinstance(nd.repo, SqliteRepo):
+            if not args.no_refresh:
+                nd.repo.invalidate(allow_stale=args.read_only)
+        else:
+            nd.repo.invalidate()
+        return args.func(args, nd)
+    finally:
+        nd.repo.conf.preview_mode = preview_mode
+
+
 def argparser() -> argparse.ArgumentParser:
     fields_help = f'Possible fields are: {", ".join(f.name for f in dataclasses.fields(FileInfoReq))}.'
 
+    no_refresh_help = ('Answer from the existing cache without checking for changed files, if the cache has been '
+                       'built before. Only applies when using the SQLite cache.')
+
     parser = argparse.ArgumentParser()
-    parser.set_defaults(func=None, preview=False)
+    parser.set_defaults(func=None, preview=False, read_only=False, no_refresh=False, local=False)
+    parser.add_argument('--no-server', action='store_true',
+                        help='Run the command in this process even if a server started by "notesdir serve" is '
+                             'running.')
 
     subs = parser.add_subparsers(title='Commands')
 
@@ -177,8 +276,9 @@ def argparser() -> argparse.ArgumentParser:
     p_i.add_argument('-f', '--fields', nargs=1,
                      help=f'Comma-separated list of fields to show. {fields_help} By default, all fields are shown.')
     p_i.add_argument('-j', '--json', action='store_true', help='Output as JSON.')
+    p_i.add_argument('--no-refresh', action='store_true', help=no_refresh_help)
     p_i.add_argument('path', nargs=1)
-    p_i.set_defaults(func=_info)
+    p_i.set_defaults(func=_info, read_only=True)
 
     p_q = subs.add_parser(
         'query',
@@ -190,7 +290,25 @@ def argparser() -> argparse.ArgumentParser:
     p_q_formats = p_q.add_mutually_exclusive_group()
     p_q_formats.add_argument('-j', '--json', help='Output as JSON.', action='store_true')
     p_q_formats.add_argument('-t', '--table', help='Format output as a table.', action='store_true')
-    p_q.set_defaults(func=_query)
+    p_q_formats.add_argument('--ndjson', action='store_true',
+                             help='Output one JSON object per line, as soon as each result is found. Unlike --json, '
+                                  'results are not sorted by path unless the query says to sort them.')
+    p_q.add_argument('--no-refresh', action='store_true', help=no_refresh_help)
+    p_q.set_defaults(func=_query, read_only=True)
+
+    p_s = subs.add_parser(
+        'search',
+        help='Search the titles and text of files. When using the SQLite cache, results are ordered by relevance, '
+             'and each is shown with a snippet of the matching text.')
+    p_s.add_argument('text', nargs='+',
+                     help='Words to search for. Files must contain all of them. Put several words in one argument, '
+                          'such as "ice cream", to search for a phrase.')
+    p_s.add_argument('-q', '--query', help='Query string to further filter the files by, in the same format as for '
+                                           'the `query` command, such as "tag:food limit:10".')
+    p_s.add_argument('-j', '--json', action='store_true',
+                     help='Output as JSON. The output is a list of objects with path, title, and snippet keys.')
+    p_s.add_argument('--no-refresh', action='store_true', help=no_refresh_help)
+    p_s.set_defaults(func=_search, read_only=True)
 
     p_c = subs.add_parser('new',
                           help='Create new file from a Mako template. You can either specify the path to the template, '
@@ -267,7 +385,8 @@ def argparser() -> argparse.ArgumentParser:
     p_tags_count.add_argument('-j', '--json', action='store_true',
                               help='Output as JSON. The output is an object whose keys are tags and whose values '
                                    'are the number of notes that matched the query and also possess that tag.')
-    p_tags_count.set_defaults(func=_tags)
+    p_tags_count.add_argument('--no-refresh', action='store_true', help=no_refresh_help)
+    p_tags_count.set_defaults(func=_tags, read_only=True)
 
     p_relink = subs.add_parser(
         'relink',
@@ -282,9 +401,57 @@ def argparser() -> argparse.ArgumentParser:
                           help='Print changes to be made but do not change files')
     p_relink.set_defaults(func=_relink)
 
+    p_index = subs.add_parser(
+        'index',
+        help='Update the SQLite cache now. Other commands do this automatically, so this is only useful for doing '
+             'it ahead of time.')
+    p_index.add_argument('-r', '--rebuild', action='store_true',
+                         help='Discard the cache and build it again from scratch. This is faster than updating it '
+                              'when most files have changed, and other processes will keep seeing the old cache '
+                              'until the new one is complete.')
+    p_index.set_defaults(func=_index)
+
+    p_watch = subs.add_parser(
+        'watch',
+        help='Keep the SQLite cache up to date as files change, until interrupted. Other processes using the cache '
+             'only benefit if conf.repo_conf.max_staleness is set.')
+    p_watch.add_argument('--debounce', type=float, default=0.5, metavar='SECONDS',
+                         help='How long to wait for further changes after a file changes before updating the cache '
+                              '(default: 0.5).')
+    p_watch.set_defaults(func=_watch, local=True)
+
+    p_serve = subs.add_parser(
+        'serve',
+        help='Keep running in the background and handle commands sent by other invocations of notesdir, so that they '
+             'do not have to load the configuration and cache each time.')
+    p_serve.add_argument('--socket', metavar='PATH',
+                         help='Path of the Unix domain socket to listen on. Defaults to the NOTESDIR_SOCKET '
+                              'environment variable, or ~/.notesdir.sock if that is not set.')
+    p_serve.set_defaults(func=_serve, local=True)
+
     return parser
 
 
+def _run(args, argv: List[str]) -> int:
+    if not (args.local or args.no_server):
+        forwarded = forward(argv, default_socket_path())
+        if forwarded:
+            exit_code, stdout, stderr = forwarded
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            return exit_code
+    with Notesdir.for_user() as nd:
+        if args.preview:
+            nd.repo.conf.preview_mode = True
+        if isinstance(nd.repo.conf, SqliteRepoConf):
+            if args.no_refresh:
+                nd.repo.conf.max_staleness = math.inf
+            elif not args.read_only:
+                # Commands that change files need up-to-date links, regardless of max_staleness
+                nd.repo.invalidate()
+        return args.func(args, nd)
+
+
 def main(args=None) -> int:
     """Runs the tool and returns its exit code.
 
@@ -292,11 +459,15 @@ def main(args=None) -> int:
     the process's arguments are used.
     """
     parser = argparser()
-    args = parser.parse_args(args)
+    argv = sys.argv[1:] if args is None else args
+    args = parser.parse_args(argv)
     if not args.func:
         parser.print_help()
         return 1
-    with Notesdir.for_user() as nd:
-        if args.preview:
-            nd.repo.conf.preview_mode = True
-        return args.func(args, nd)
+    try:
+        return _run(args, argv)
+    except BrokenPipeError:
+        # Whatever was reading the output (such as `head`) exited early. Python would fail again when flushing
+        # stdout during shutdown, so send any remaining output nowhere.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
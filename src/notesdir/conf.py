@@ -145,6 +145,17 @@ class RepoConf:
 @dataclass
 class DirectRepoConf(RepoConf):
     """Configures notesdir to access notes without caching, via :class:`notesdir.repos.DirectRepo`."""
+
+    pdf_text: bool = False
+    """If True, text is extracted from PDF files so that they can be found by text searches.
+    
+    Text searches are done with the ``text:`` query term or the ``search`` command. This is off by default because
+    extracting text from PDFs is slow, and the extracted text is often incomplete.
+    
+    When using :class:`SqliteRepoConf`, changing this only affects PDFs that are parsed again afterward; delete the
+    cache file if you want it to apply to all of them.
+    """
+
     def instantiate(self):
         from notesdir.repos.direct import DirectRepo
         return DirectRepo(self.standardize())
@@ -157,10 +168,73 @@ class SqliteRepoConf(DirectRepoConf):
     cache_path: str = None
     """Required. Path where the SQLite database file should be stored.
     
-    The file will be created if it does not exist.
+    The file will be created if it does not exist. A relative path (or one starting with ``~``) is made absolute
+    when the repo is created.
     The file is only a cache; you can safely delete it when the tool is not running, though you will then have to
     wait for the cache to be rebuilt the next time you run the tool."""
 
+    parse_workers: Optional[int] = 1
+    """Number of processes to use for parsing changed files when refreshing the cache.
+    
+    The default of 1 parses files in the main process. Larger values help when many files need to be parsed at once,
+    such as when the cache is first built. None means to use one process per CPU.
+    """
+
+    skip_unchanged_dirs: bool = False
+    """If True, refreshing the cache skips listing directories whose modification time has not changed.
+    
+    The files and subdirectories found in such a directory the last time it was listed are assumed to still be
+    there. This can make refreshing much faster for large collections of notes that rarely change, but note that
+    modifying a file in place does not change its directory's modification time, so such changes will only be
+    noticed as often as :attr:`unchanged_dir_check_interval` allows (or when the file is changed via notesdir).
+    """
+
+    unchanged_dir_check_interval: float = 3600
+    """When :attr:`skip_unchanged_dirs` is True, this is how many seconds may pass before files in unchanged
+    directories are checked for modifications again."""
+
+    content_digests: bool = False
+    """If True, a digest of each file's contents is stored in the cache.
+    
+    When a file's timestamps change but its size does not, its contents are hashed and compared to the stored
+    digest, and the file is only parsed again if they differ. This helps when tools like ``git checkout`` or backup
+    restores touch many files without changing them, since hashing is much cheaper than parsing.
+    """
+
+    max_staleness: Optional[float] = None
+    """If set, a new instance skips its initial refresh if the cache was refreshed within this many seconds.
+    
+    This makes lookups much faster for large collections of notes, at the cost of possibly missing recent changes
+    to files. It only applies to the refresh that normally happens when an instance is created; calling
+    :meth:`notesdir.repos.sqlite.SqliteRepo.invalidate` still causes a refresh before the next read.
+    
+    Commands that change files, such as ``mv`` and ``organize``, ignore this setting, since they need up-to-date
+    links. If you change files via the Python API with this setting enabled, call ``invalidate`` first.
+    
+    Instead of setting this, you can pass ``--no-refresh`` to commands like ``info`` and ``query`` to skip the
+    refresh regardless of when it last happened.
+    
+    While ``notesdir watch`` is running, the cache is kept up to date and regularly marked as fresh, so a small
+    value such as ``10`` is enough to skip nearly all refreshes.
+    """
+
+    lazy_refresh: bool = False
+    """If True, looking up a single file does not wait for a pending refresh of the whole cache.
+    
+    Instead, only that file is checked for changes, along with (if backlinks are requested) the files that the cache
+    says link to it. Backlinks from files that were created or edited to add a link since the last full refresh will
+    be missing. The full refresh still happens before the next query or other operation that needs it, and this
+    setting has no effect until the cache has been fully built once.
+    """
+
+    def standardize(self):
+        result = super().standardize()
+        # The lock file and the temporary file used by rebuilds are named after the cache file, so every process must
+        # agree on where it is, however the working directory changes.
+        if self.cache_path and self.cache_path != ':memory:':
+            result = replace(result, cache_path=os.path.abspath(os.path.expanduser(self.cache_path)))
+        return result
+
     def instantiate(self):
         from notesdir.repos.sqlite import SqliteRepo
         return SqliteRepo(self.standardize())
@@ -7,12 +7,16 @@ from __future__ import annotations
 from dataclasses import dataclass, field, replace
 from datetime import datetime, timezone
 from enum import Enum
+from itertools import islice
 import os
 import os.path
-from typing import Set, Optional, Union, Iterable, List, Callable, Iterator, Tuple
+from typing import Dict, Set, Optional, Union, Iterable, List, Callable, Iterator, Tuple
 from urllib.parse import urlparse, unquote_plus
 
 
+_UNRESOLVED = object()
+
+
 @dataclass
 class LinkInfo:
     """Represents a link from a file to some resource.
@@ -21,6 +25,10 @@ class LinkInfo:
     can be used to determine what local file, if any, the href targets.
     """
 
+    # Cached result of referent(); this is a plain class attribute rather than a dataclass field, so it does not
+    # affect equality or the generated constructor.
+    _referent = _UNRESOLVED
+
     referrer: str
     """The file that contains the link. This should be a resolved, absolute path."""
 
@@ -37,7 +45,21 @@ class LinkInfo:
         The path will be returned even if no file or folder actually exists at that location.
 
         None will be returned if the href cannot be parsed or appears to be a non-file URI.
+
+        The result is cached on the instance, so do not change :attr:`referrer` or :attr:`href` after calling this.
         """
+        if self._referent is _UNRESOLVED:
+            self._referent = self._resolve()
+        return self._referent
+
+    @classmethod
+    def resolved(cls, referrer: str, href: str, referent: Optional[str]) -> LinkInfo:
+        """Creates an instance whose :meth:`referent` is already known, such as from a cache."""
+        link = cls(referrer, href)
+        link._referent = referent
+        return link
+
+    def _resolve(self) -> Optional[str]:
         try:
             url = urlparse(self.href)
             if (not url.scheme) or (url.scheme == 'file' and url.netloc in ['', 'localhost']):
@@ -96,16 +118,26 @@ class FileInfo:
     backlinks: List[LinkInfo] = field(default_factory=list)
     """Links from other files to this file."""
 
-    def as_json(self) -> dict:
-        """Returns a dict representing the instance, suitable for serializing as json."""
-        return {
-            'path': self.path,
-            'title': self.title,
-            'created': self.created.isoformat() if self.created else None,
-            'tags': sorted(self.tags),
-            'links': [link.as_json() for link in self.links],
-            'backlinks': [link.as_json() for link in self.backlinks]
-        }
+    def as_json(self, fields: FileInfoReqIsh = None) -> dict:
+        """Returns a dict representing the instance, suitable for serializing as json.
+
+        If fields are given, only those keys are included; otherwise, all of them are.
+        """
+        fields = FileInfoReq.full() if fields is None else FileInfoReq.parse(fields)
+        result = {}
+        if fields.path:
+            result['path'] = self.path
+        if fields.title:
+            result['title'] = self.title
+        if fields.created:
+            result['created'] = self.created.isoformat() if self.created else None
+        if fields.tags:
+            result['tags'] = sorted(self.tags)
+        if fields.links:
+            result['links'] = [link.as_json() for link in self.links]
+        if fields.backlinks:
+            result['backlinks'] = [link.as_json() for link in self.backlinks]
+        return result
 
     def guess_created(self) -> Optional[datetime]:
         """Returns the first available of: :attr:`created`, or the file's birthtime, or the file's ctime.
@@ -208,6 +240,18 @@ class ReplaceHrefCmd(FileEditCmd):
     """The new link address."""
 
 
+@dataclass
+class ReplaceHrefsCmd(FileEditCmd):
+    """Represents a request to replace several link addresses in a document at once.
+
+    This is equivalent to a :class:`ReplaceHrefCmd` for each item, except that the replacements are applied
+    simultaneously, in a single pass over the document. So ``{'a.md': 'b.md', 'b.md': 'a.md'}`` swaps the two links.
+    """
+
+    replacements: Dict[str, str]
+    """Maps each value to be replaced to its new link address."""
+
+
 @dataclass
 class AddTagCmd(FileEditCmd):
     """Represents a request to add a tag to a document.
@@ -324,6 +368,14 @@ class FileQuery:
     exclude_tags: Set[str] = field(default_factory=set)
     """If non-empty, the query should only return files that have *none* of the specified tags."""
 
+    include_text: List[str] = field(default_factory=list)
+    """If non-empty, the query should only return files whose title or text contains *all* of the specified words.
+
+    Each entry may also be a phrase of several words, which must appear consecutively. Matching is case-insensitive
+    and ignores punctuation. When using :class:`notesdir.repos.sqlite.SqliteRepo`, results are ordered by relevance
+    unless :attr:`sort_by` is set.
+    """
+
     sort_by: List[FileQuerySort] = field(default_factory=list)
     """Indicates how to sort the results.
     
@@ -332,6 +384,12 @@ class FileQuery:
     would be sorted lexicographically.
     """
 
+    limit: Optional[int] = None
+    """If set, at most this many files should be returned, after sorting and skipping :attr:`offset` files."""
+
+    offset: int = 0
+    """The number of files to skip, after sorting, before returning any."""
+
     @classmethod
     def parse(cls, strquery: FileQueryIsh) -> FileQuery:
         """Converts the parameter to a FileQuery, if it isn't one already.
@@ -340,15 +398,22 @@ class FileQuery:
 
         * ``tag:TAG1,TAG2`` - notes must include all the specified tags
         * ``-tag:TAG1,TAG2`` - notes must not include any of the specified tags
+        * ``text:WORD`` - notes must contain the given word in their title or text
+            * use plus signs to search for a phrase, e.g. ``text:ice+cream``
         * ``sort:FIELD1,FIELD2`` - sort by the given fields
             * fields on the left take higher priority, e.g. ``sort:created,title`` sorts by created date first
             * a minus sign in front of a field name indicates to sort descending, e.g. ``sort:-backlinks`` or
               ``sort:filename,-created``
             * supported fields: ``backlinks`` (count), ``created``, ``filename``, ``tags`` (count) ``title``, ``path``
+        * ``limit:N`` - return at most N notes
+        * ``offset:N`` - skip the first N notes (after sorting)
+            * N must not be negative; a ValueError is raised if it is
 
         Examples:
 
         * ``"tag:journal,food -tag:personal"`` - notes that are tagged both "journal" and "food" but not "personal"
+        * ``"sort:-backlinks limit:20"`` - the 20 notes with the most backlinks
+        * ``"text:donuts tag:food"`` - notes tagged "food" that mention donuts
         """
         if isinstance(strquery, FileQuery):
             return strquery
@@ -360,6 +425,8 @@ class FileQuery:
                 query.include_tags.update(unquote_plus(t) for t in lower[4:].split(','))
             elif lower.startswith('-tag:'):
                 query.exclude_tags.update(unquote_plus(t) for t in lower[5:].split(','))
+            elif lower.startswith('text:'):
+                query.include_text.append(unquote_plus(term[5:]))
             elif lower.startswith('sort:'):
                 for sortstr in lower[5:].split(','):
                     sort = FileQuerySort(FileQuerySortField.TITLE)  # placeholder value
@@ -369,6 +436,14 @@ class FileQuery:
                     # TODO perhaps expose missing_first and ignore_case
                     sort.field = FileQuerySortField(sortstr)
                     query.sort_by.append(sort)
+            elif lower.startswith('limit:'):
+                query.limit = int(lower[6:])
+                if query.limit < 0:
+                    raise ValueError(f'Limit must not be negative: {term}')
+            elif lower.startswith('offset:'):
+                query.offset = int(lower[7:])
+                if query.offset < 0:
+                    raise ValueError(f'Offset must not be negative: {term}')
         return query
 
     def apply_filtering(self, infos: Iterable[FileInfo]) -> Iterator[FileInfo]:
@@ -390,6 +465,11 @@ class FileQuery:
             result.sort(key=lambda info: sort.key(info), reverse=sort.reverse)
         return result
 
+    def apply_limit(self, infos: Iterable[FileInfo]) -> Iterator[FileInfo]:
+        """Yields the entries from the given iterable that fall within this query's offset and limit."""
+        stop = None if self.limit is None else self.offset + self.limit
+        yield from islice(infos, self.offset, stop)
+
 
 FileQueryIsh = Union[str, FileQuery]
 
@@ -4,13 +4,13 @@ Generally, you should use :meth:`notesdir.api.Notesdir.move` or :meth:`notesdir.
 instead of using anything in this module directly.
 """
 
+from collections import defaultdict
 from glob import glob
 import os.path
 from tempfile import mkstemp
 from typing import Dict, Iterator, Set
 from urllib.parse import ParseResult, quote, urlunparse, urlparse
-import shortuuid
-from notesdir.models import MoveCmd, ReplaceHrefCmd, FileEditCmd, FileInfoReq
+from notesdir.models import MoveCmd, ReplaceHrefsCmd, FileEditCmd, FileInfoReq
 from notesdir.repos.base import Repo
 
 
@@ -38,6 +38,7 @@ def find_available_name(dest: str, also_unavailable: Set[str], src: str = None)
         suffix = f'.{parts[1]}'
     else:
         suffix = ''
+    import shortuuid
     while dest in also_unavailable or os.path.exists(dest):
         if src:
             # HACK: This is so that if `organize` has to attach a UUID to the end of a
@@ -109,12 +110,16 @@ def edits_for_raw_moves(renames: Dict[str, str]) -> Iterator[MoveCmd]:
     yield from phase2
 
 
-def edits_for_path_replacement(referrer: str, hrefs: Set[str], replacement: str) -> Iterator[ReplaceHrefCmd]:
-    """Yields commands to replace a file's links to a path with links to another path."""
-    for href in hrefs:
-        url = urlparse(href)
-        newref = path_as_href(href_path(referrer, replacement), url)
-        yield ReplaceHrefCmd(referrer, href, newref)
+def _replacement_href(referrer: str, href: str, replacement: str) -> str:
+    return path_as_href(href_path(referrer, replacement), urlparse(href))
+
+
+def edits_for_path_replacement(referrer: str, hrefs: Set[str], replacement: str) -> Iterator[ReplaceHrefsCmd]:
+    """Yields a command to replace a file's links to a path with links to another path."""
+    replacements = {href: _replacement_href(referrer, href, replacement) for href in hrefs}
+    replacements = {h: r for h, r in replacements.items() if not h == r}
+    if replacements:
+        yield ReplaceHrefsCmd(referrer, replacements)
 
 
 def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEditCmd]:
@@ -125,9 +130,10 @@ def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEd
     as a value, it will be moved to a temporary file as an intermediate step.)
 
     The given store is used to search for files that link to any of the paths that
-    are keys in the dictionary, so that ReplaceHrefEditCmd instances can be generated for them.
+    are keys in the dictionary, so that ReplaceHrefsCmd instances can be generated for them.
     The files that are being renamed will also be checked for outbound links,
-    and ReplaceRef edits will be generated for those too.
+    and ReplaceHrefsCmd edits will be generated for those too. There is at most one
+    ReplaceHrefsCmd per file, covering all of that file's links that need updating.
 
     Source paths may be directories; the directory as a whole will be moved, and links
     to/from all files/folders within it will be updated too.
@@ -140,9 +146,12 @@ def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEd
             for path in glob(os.path.join(src, '**', '*'), recursive=True):
                 all_moves[path] = os.path.join(dest, os.path.relpath(path, src))
 
+    # Edits to files that link to the moved files are collected here, so that each file gets a single edit
+    backlink_replacements = defaultdict(dict)
     for src, dest in all_moves.items():
         info = store.info(src, FileInfoReq(path=True, links=True, backlinks=True))
         if info:
+            replacements = {}
             for link in info.links:
                 referent = link.referent()
                 if not referent:
@@ -157,11 +166,16 @@ def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEd
                     continue
                 newhref = path_as_href(href_path(dest, referent), url)
                 if not link.href == newhref:
-                    yield ReplaceHrefCmd(src, link.href, newhref)
+                    replacements[link.href] = newhref
+            if replacements:
+                yield ReplaceHrefsCmd(src, replacements)
         for link in info.backlinks:
             if link.referrer in all_moves:
                 continue
-            # TODO either pass in all the hrefs at once, or change method to not take in a set
-            yield from edits_for_path_replacement(link.referrer, {link.href}, dest)
+            newhref = _replacement_href(link.referrer, link.href, dest)
+            if not link.href == newhref:
+                backlink_replacements[link.referrer][link.href] = newhref
+    for referrer, replacements in backlink_replacements.items():
+        yield ReplaceHrefsCmd(referrer, replacements)
 
     yield from edits_for_raw_moves(to_move)
@@ -4,7 +4,7 @@ The most important class is :class:`Repo`.
 """
 
 from datetime import datetime
-from typing import Dict, List, Iterator, Set
+from typing import Dict, List, Iterator, Optional, Set, Tuple
 
 from notesdir.models import FileInfo, FileEditCmd, MoveCmd, FileQuery, SetTitleCmd, SetCreatedCmd, AddTagCmd,\
     DelTagCmd, ReplaceHrefCmd, FileInfoReq, FileInfoReqIsh, FileQueryIsh, CreateCmd
@@ -59,6 +59,17 @@ class Repo:
         """Returns the requested fields for all files matching the given query."""
         raise NotImplementedError()
 
+    def search(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
+            -> Iterator[Tuple[FileInfo, Optional[str]]]:
+        """Like :meth:`query`, but also returns a snippet of each file's text for showing in search results.
+
+        The snippet should show where the file matched the query's :attr:`notesdir.models.FileQuery.include_text`
+        terms, with matched words surrounded by ``**``. It may be None if the repo does not support snippets, which
+        is the case for this default implementation.
+        """
+        for info in self.query(query, fields):
+            yield info, None
+
     def tag_counts(self, query: FileQueryIsh = FileQuery()) -> Dict[str, int]:
         """Returns a map of tag names to the number of files matching the query which posses that tag."""
         raise NotImplementedError()
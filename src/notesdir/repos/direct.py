@@ -5,25 +5,52 @@ from operator import attrgetter
 from collections import defaultdict, namedtuple
 import os
 import os.path
-from typing import List, Dict, Iterator, Set
+import re
+from typing import List, Dict, Iterator, Optional, Set
 
 from notesdir.accessors.delegating import DelegatingAccessor
 from notesdir.conf import DirectRepoConf
 from notesdir.models import FileInfo, FileEditCmd, MoveCmd, FileQuery, FileInfoReq, FileInfoReqIsh,\
-    FileQueryIsh, CreateCmd
+    FileQueryIsh, FileQuerySortField, CreateCmd, LinkInfo
 from notesdir.repos.base import Repo, _group_edits
 
 
 PathEntry = namedtuple('PathEntry', ['dir_entry', 'skip_parse'])
 
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _contains_phrase(words: List[str], phrase: str) -> bool:
+    """Approximates how SQLite's full-text search matches a phrase, so that both repos give similar results."""
+    phrase_words = _words(phrase)
+    count = len(phrase_words)
+    return count > 0 and any(words[i:i + count] == phrase_words for i in range(len(words) - count + 1))
+
+
+def _edited_paths(edits: List[FileEditCmd]) -> Set[str]:
+    """Returns the paths whose cached data may be affected by the given edits."""
+    paths = set()
+    for edit in edits:
+        paths.add(os.path.abspath(edit.path))
+        if isinstance(edit, MoveCmd):
+            paths.add(os.path.abspath(edit.dest))
+    return paths
+
 
 class DirectRepo(Repo):
-    """Accesses notes directly on the filesystem without any caching.
+    """Accesses notes directly on the filesystem without a persistent cache.
 
     This performs fine if you only have a few dozen notes, but beyond that you want a caching implementation
     (see :class:`notesdir.repos.sqlite.SqliteRepo`), because looking up backlinks for a file requires reading all
     the other files, which gets very slow.
 
+    The first backlinks lookup builds an in-memory index of all links, which later lookups by the same instance
+    reuse. Call :meth:`invalidate` after changing files by means other than :meth:`change`.
+
     .. attribute:: conf
        :type: DirectRepoConf
     """
@@ -32,6 +59,10 @@ class DirectRepo(Repo):
         if not conf.root_paths:
             raise ValueError('`root_paths` must be non-empty in RepoConf.')
         self.accessor_factory = DelegatingAccessor
+        # The backlinks index; _links_by_referrer is None until it has been built.
+        self._links_by_referrer = None
+        self._backlinks_by_referent = None
+        self._stale_referrers = set()
 
     def _should_skip_parse(self, path: str) -> bool:
         parent, basename = os.path.split(path)
@@ -51,14 +82,14 @@ class DirectRepo(Repo):
             skip_parse = self._should_skip_parse(path)
         fields = FileInfoReq.parse(fields)
 
-        if skip_parse or not os.path.exists(path):
+        if skip_parse or not (fields.links or fields.tags or fields.title or fields.created)\
+                or not os.path.exists(path):
             info = FileInfo(path)
         else:
-            info = self.accessor_factory(path).info()
+            info = self.accessor_factory(path).info(fields)
 
         if fields.backlinks:
-            for other in self.query(fields=FileInfoReq(path=True, links=True)):
-                info.backlinks.extend(link for link in other.links if link.referent() == path)
+            info.backlinks.extend(self._backlinks_index().get(path, []))
             info.backlinks.sort(key=attrgetter('referrer', 'href'))
 
         return info
@@ -95,10 +126,54 @@ class DirectRepo(Repo):
                 for edit in group:
                     acc.edit(edit)
                 acc.save()
+        if not self.conf.preview_mode:
+            self._invalidate_backlinks(_edited_paths(edits))
 
     def invalidate(self, only: Set[str] = None):
-        """No-op."""
-        pass
+        """Discards the backlinks index, or just the entries for links from the given paths."""
+        self._invalidate_backlinks(only)
+
+    def _invalidate_backlinks(self, only: Optional[Set[str]]) -> None:
+        if self._links_by_referrer is None:
+            return
+        if only:
+            self._stale_referrers.update(os.path.abspath(p) for p in only)
+        else:
+            self._links_by_referrer = None
+
+    def _backlinks_index(self) -> Dict[str, List[LinkInfo]]:
+        """Returns a dict mapping each path to the links that refer to it, building or updating it as needed."""
+        if self._links_by_referrer is not None and self._stale_referrers:
+            self._update_backlinks_index()
+        if self._links_by_referrer is None:
+            self._links_by_referrer = {}
+            self._backlinks_by_referent = defaultdict(list)
+            self._stale_referrers.clear()
+            for info in self.query(fields=FileInfoReq(path=True, links=True)):
+                self._index_links(info.path, info.links)
+        return self._backlinks_by_referent
+
+    def _update_backlinks_index(self) -> None:
+        stale = self._stale_referrers
+        self._stale_referrers = set()
+        for path in stale:
+            prefix = path + os.sep
+            if os.path.isdir(path) or any(referrer.startswith(prefix) for referrer in self._links_by_referrer):
+                # Simpler to start over than to work out which files were in the directory
+                self._links_by_referrer = None
+                return
+            for link in self._links_by_referrer.pop(path, []):
+                self._backlinks_by_referent[link.referent()].remove(link)
+            skip_parse = self.scan_status(path)
+            if skip_parse is not None and os.path.isfile(path):
+                info = self.info(path, FileInfoReq(path=True, links=True), path_resolved=True, skip_parse=skip_parse)
+                self._index_links(path, info.links)
+
+    def _index_links(self, referrer: str, links: List[LinkInfo]) -> None:
+        links = [link for link in links if link.referent()]
+        self._links_by_referrer[referrer] = links
+        for link in links:
+            self._backlinks_by_referent[link.referent()].append(link)
 
     def _paths(self) -> Iterator[PathEntry]:
         for root in self.conf.root_paths:
@@ -107,6 +182,31 @@ class DirectRepo(Repo):
                 skip_parse = self.conf.skip_parse(parent, basename)
                 yield from self._paths_in(root, skip_parse=skip_parse)
 
+    def scan_status(self, path: str) -> Optional[bool]:
+        """Returns whether the given resolved path is one of the repo's files or directories, and how it is treated.
+
+        Returns None if the path is not within the root paths, or would be ignored (see
+        :attr:`notesdir.conf.RepoConf.ignore`). Otherwise, returns True if the file would not be parsed (see
+        :attr:`notesdir.conf.RepoConf.skip_parse`), or False if it would.
+        """
+        for root in self.conf.root_paths:
+            relpath = os.path.relpath(path, root)
+            if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+                continue
+            parent, basename = os.path.split(root)
+            skip_parse = self.conf.skip_parse(parent, basename)
+            if relpath == os.curdir:
+                return skip_parse
+            dirpath = root
+            for name in relpath.split(os.sep):
+                child = os.path.join(dirpath, name)
+                if os.path.islink(child) or self.conf.ignore(dirpath, name):
+                    return None
+                skip_parse = skip_parse or self.conf.skip_parse(dirpath, name)
+                dirpath = child
+            return skip_parse
+        return None
+
     def _paths_in(self, dirpath: str, skip_parse: bool) -> Iterator[PathEntry]:
         for entry in os.scandir(dirpath):
             if entry.is_symlink():
@@ -119,15 +219,37 @@ class DirectRepo(Repo):
             else:
                 yield PathEntry(entry, skip_parse=entry_skip_parse)
 
+    def _wants_text(self, path: str) -> bool:
+        return self.conf.pdf_text or not path.endswith('.pdf')
+
+    def _text_matches(self, info: FileInfo, phrases: List[str]) -> bool:
+        title_words = _words(info.title or '')
+        text = None
+        if os.path.isfile(info.path) and self._wants_text(info.path):
+            text = self.accessor_factory(info.path).text()
+        text_words = _words(text or '')
+        return all(_contains_phrase(title_words, p) or _contains_phrase(text_words, p) for p in phrases)
+
     def query(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
             -> Iterator[FileInfo]:
-        fields = dataclasses.replace(FileInfoReq.parse(fields),
-                                     tags=(fields.tags or query.include_tags or query.exclude_tags))
         query = FileQuery.parse(query)
-        filtered = query.apply_filtering(
-            self.info(e.dir_entry.path, fields, path_resolved=True, skip_parse=e.skip_parse)
-            for e in self._paths())
-        yield from query.apply_sorting(filtered)
+        fields = FileInfoReq.parse(fields)
+        sort_fields = {s.field for s in query.sort_by}
+        fields = dataclasses.replace(
+            fields,
+            tags=bool(fields.tags or query.include_tags or query.exclude_tags
+                      or FileQuerySortField.TAGS_COUNT in sort_fields),
+            title=bool(fields.title or query.include_text or FileQuerySortField.TITLE in sort_fields),
+            created=bool(fields.created or FileQuerySortField.CREATED in sort_fields),
+            backlinks=bool(fields.backlinks or FileQuerySortField.BACKLINKS_COUNT in sort_fields))
+        infos = (self.info(e.dir_entry.path, fields, path_resolved=True, skip_parse=e.skip_parse)
+                 for e in self._paths() if not (query.include_text and e.skip_parse))
+        if query.include_text:
+            infos = (i for i in infos if self._text_matches(i, query.include_text))
+        filtered = query.apply_filtering(infos)
+        if query.sort_by:
+            filtered = query.apply_sorting(filtered)
+        yield from query.apply_limit(filtered)
 
     def tag_counts(self, query: FileQueryIsh = FileQuery()) -> Dict[str, int]:
         query = FileQuery.parse(query)
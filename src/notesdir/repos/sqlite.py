@@ -1,19 +1,44 @@
 """Provides the :class:`SqliteRepo` class."""
 
-from collections import namedtuple
-from datetime import datetime
-import dataclasses
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+import hashlib
+from itertools import islice, repeat
 from operator import attrgetter
 import os.path
 import sqlite3
-from typing import List, Iterator, Set
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Iterator, Optional, Set, Tuple
+from notesdir.accessors.base import Accessor, ParseError
 from notesdir.conf import SqliteRepoConf
 from notesdir.models import FileInfo, FileEditCmd, FileInfoReq, FileQuery, FileQueryIsh, FileInfoReqIsh,\
-    LinkInfo
-from notesdir.repos.direct import DirectRepo
-
+    LinkInfo, FileQuerySortField
+from notesdir.repos.direct import DirectRepo, _edited_paths
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; concurrent refreshes are then only serialized by SQLite's own locking.
+    fcntl = None
+
+
+# Increment this whenever _SQL_CREATE_SCHEMA changes in a way that existing tables cannot just be reused.
+# Since the database is only a cache, an outdated one is simply dropped and rebuilt.
+_SCHEMA_VERSION = 3
+
+_SQL_DROP_SCHEMA = """
+DROP TABLE IF EXISTS meta;
+DROP TABLE IF EXISTS file_text;
+DROP TABLE IF EXISTS dirs;
+DROP TABLE IF EXISTS file_links;
+DROP TABLE IF EXISTS file_tags;
+DROP TABLE IF EXISTS files;
+"""
 
-_SQL_CREATE_SCHEMA = """
+_SQL_CREATE_TABLES = """
 CREATE TABLE IF NOT EXISTS files (
     id INTEGER PRIMARY KEY,
     path TEXT NOT NULL,
@@ -22,20 +47,16 @@ CREATE TABLE IF NOT EXISTS files (
     stat_mtime INTEGER,
     stat_size INTEGER,
     title TEXT,
-    created TEXT
+    created TEXT,
+    digest BLOB
 );
 
-CREATE UNIQUE INDEX IF NOT EXISTS files_index_path ON files (path);
-
 CREATE TABLE IF NOT EXISTS file_tags (
     file_id INTEGER NOT NULL,
     tag TEXT NOT NULL,
     FOREIGN KEY(file_id) REFERENCES files(id)
 );
 
-CREATE UNIQUE INDEX IF NOT EXISTS file_tags_index_file_id_tag ON file_tags (file_id, tag);
-CREATE INDEX IF NOT EXISTS file_tags_index_tag ON file_tags (tag);
-
 CREATE TABLE IF NOT EXISTS file_links (
     id INTEGER PRIMARY KEY,
     referrer_id INTEGER NOT NULL,
@@ -45,31 +66,254 @@ CREATE TABLE IF NOT EXISTS file_links (
     FOREIGN KEY(referent_id) REFERENCES files(id)
 );
 
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT NOT NULL,
+    stat_mtime INTEGER,
+    checked REAL
+);
+
+-- The rowid of each entry is the id of the corresponding row in files.
+CREATE VIRTUAL TABLE IF NOT EXISTS file_text USING fts5(title, body);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+# Kept separate so that a rebuild can create the indexes after inserting all the data.
+_SQL_CREATE_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS files_index_path ON files (path);
+CREATE UNIQUE INDEX IF NOT EXISTS file_tags_index_file_id_tag ON file_tags (file_id, tag);
+CREATE INDEX IF NOT EXISTS file_tags_index_tag ON file_tags (tag);
 CREATE INDEX IF NOT EXISTS file_links_referrer_id_href ON file_links (referrer_id, href);
 CREATE INDEX IF NOT EXISTS file_links_referrer_id_referent_id ON file_links (referrer_id, referent_id);
 CREATE INDEX IF NOT EXISTS file_links_referent_id_referrer_id ON file_links (referent_id, referrer_id);
+CREATE UNIQUE INDEX IF NOT EXISTS dirs_index_path ON dirs (path);
 """
 
+_SQL_CREATE_SCHEMA = _SQL_CREATE_TABLES + _SQL_CREATE_INDEXES
+
 _SQL_CLEAR = """
+DELETE FROM meta;
+DELETE FROM dirs;
 DELETE FROM files;
 DELETE FROM file_tags;
-DELETE_FROM file_refs;
+DELETE FROM file_text;
+DELETE FROM file_links;
 """
 
 
-_SQL_ALL_FOR_REFRESH = 'SELECT id, path, stat_ctime, stat_mtime, stat_size FROM files'
-_SqlAllForRefreshRow = namedtuple('SqlAllForRefreshRow', ['id', 'path', 'stat_ctime', 'stat_mtime', 'stat_size'])
+# Seconds to wait for another process to finish writing to the database before giving up.
+_BUSY_TIMEOUT = 60
+
+# Key in the meta table for the time.time() at which the most recently committed full refresh began.
+_META_REFRESH_STARTED = 'refresh_started'
+
+# Number of files whose related rows are loaded with each `IN (...)` query; kept well below SQLite's default
+# limit of 999 parameters per statement.
+_SQL_BATCH_SIZE = 500
 
-_SQL_INSERT_FILE = ('INSERT INTO files (path, existent, stat_ctime, stat_mtime, stat_size, title, created)'
-                    ' VALUES (?, ?, ?, ?, ?, ?, ?)')
+_SQL_ALL_FOR_REFRESH = 'SELECT id, path, existent, stat_ctime, stat_mtime, stat_size, digest FROM files'
+_SqlAllForRefreshRow = namedtuple('SqlAllForRefreshRow', ['id', 'path', 'existent', 'stat_ctime', 'stat_mtime',
+                                                          'stat_size', 'digest'])
+
+_SQL_INSERT_FILE = ('INSERT INTO files (path, existent, stat_ctime, stat_mtime, stat_size, title, created, digest)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
 _SqlInsertFileRow = namedtuple('SqlInsertFileRow', ['path', 'existent', 'stat_ctime', 'stat_mtime', 'stat_size',
-                                                    'title', 'created'])
+                                                    'title', 'created', 'digest'])
 
 _SQL_UPDATE_FILE = ('UPDATE files SET existent = ?, stat_ctime = ?, stat_mtime = ?, stat_size = ?,'
-                    ' title = ?, created = ?'
+                    ' title = ?, created = ?, digest = ?'
                     ' WHERE id = ?')
 _SqlUpdateFileRow = namedtuple('SqlUpdateFileRow', ['existent', 'stat_ctime', 'stat_mtime', 'stat_size',
-                                                    'title', 'created', 'id'])
+                                                    'title', 'created', 'digest', 'id'])
+
+# Operates on the IDs in the temp table missing_ids, and clears it afterward. Links from the missing files are
+# deleted first, so that files only linked to by other missing files are deleted too.
+_SQL_MARK_MISSING = [
+    'DELETE FROM file_tags WHERE file_id IN (SELECT id FROM missing_ids)',
+    'DELETE FROM file_links WHERE referrer_id IN (SELECT id FROM missing_ids)',
+    'DELETE FROM file_text WHERE rowid IN (SELECT id FROM missing_ids)',
+    'DELETE FROM files WHERE id IN (SELECT id FROM missing_ids)'
+    ' AND NOT EXISTS (SELECT 1 FROM file_links WHERE file_links.referent_id = files.id)',
+    'UPDATE files SET existent = FALSE, stat_ctime = NULL, stat_mtime = NULL, stat_size = NULL,'
+    ' title = NULL, created = NULL, digest = NULL'
+    ' WHERE id IN (SELECT id FROM missing_ids)',
+    'DELETE FROM missing_ids',
+]
+
+_SQL_INSERT_FILE_WITH_ID = ('INSERT INTO files'
+                            ' (id, path, existent, stat_ctime, stat_mtime, stat_size, title, created, digest)'
+                            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+_SQL_UPDATE_FILE_STAT = 'UPDATE files SET stat_ctime = ?, stat_mtime = ?, stat_size = ? WHERE id = ?'
+
+
+_PendingParse = namedtuple('_PendingParse', ['path', 'skip_parse', 'stat', 'row'])
+
+_ParseResult = namedtuple('_ParseResult', ['info', 'digest', 'text'])
+
+_SNIPPET_TOKENS = 16
+
+# A directory whose mtime is less than this many seconds before a refresh began may change again without its mtime
+# changing, since timestamps are coarse on some filesystems. Like git's "racy" index entries, such a directory is
+# listed again by the next refresh rather than trusted.
+_RACY_DIR_INTERVAL = 2
+
+# Paths of the descendants of a directory sort between `dirpath + os.sep` and `dirpath + _SEP_SUCCESSOR`.
+_SEP_SUCCESSOR = chr(ord(os.sep) + 1)
+
+
+def _batches(items: list) -> Iterator[list]:
+    for i in range(0, len(items), _SQL_BATCH_SIZE):
+        yield items[i:i + _SQL_BATCH_SIZE]
+
+
+def _placeholders(items: list) -> str:
+    return ', '.join('?' for _ in items)
+
+
+# Below this many changed files, starting a process pool costs more than it saves.
+_MIN_PARALLEL_PARSE = 32
+
+
+def _file_digest(path: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _parse_file(accessor_factory: Callable[[str], Accessor], path: str, skip_parse: bool, digest: bool,
+                text: bool) -> _ParseResult:
+    """Returns the info that can be determined from the given file in isolation, and optionally its digest and text.
+
+    The digest is calculated before parsing, so that if the file changes in between, the stored digest will not
+    match the new contents. If the text cannot be extracted, the error is printed and the text is None.
+    This is a module-level function so that it can be run in worker processes.
+    """
+    if skip_parse or not os.path.exists(path):
+        return _ParseResult(FileInfo(path), None, None)
+    file_digest = _file_digest(path) if digest else None
+    accessor = accessor_factory(path)
+    info = accessor.info()
+    file_text = None
+    if text:
+        try:
+            file_text = accessor.text()
+        except ParseError as e:
+            # Text extraction (from PDFs in particular) is unreliable, and the file's other info is still useful
+            print(f'{e.message}, so it will not be found by text searches: {e.path} ({e.cause!r})', file=sys.stderr)
+    return _ParseResult(info, file_digest, file_text)
+
+
+class _ReferentMemo:
+    """Resolves the referents of links, resolving each distinct (directory, href) pair only once."""
+    def __init__(self):
+        self._by_dir_href = {}
+
+    def __call__(self, link: LinkInfo) -> Optional[str]:
+        key = (os.path.dirname(link.referrer), link.href)
+        if key in self._by_dir_href:
+            return self._by_dir_href[key]
+        referent = link.referent()
+        # Links such as "#heading" refer to the referrer itself, so their result cannot be shared with
+        # other files in the same directory.
+        if not referent == link.referrer:
+            self._by_dir_href[key] = referent
+        return referent
+
+
+def _fts_match(phrases: List[str]) -> str:
+    """Returns an FTS5 query matching files that contain all the given phrases.
+
+    Each phrase is quoted so that characters with special meaning in the FTS5 query syntax are treated as punctuation.
+    """
+    return ' AND '.join('"{}"'.format(p.replace('"', '""')) for p in phrases)
+
+
+def _sql_query_filter(query: FileQuery) -> Tuple[str, str, list]:
+    """Returns joins, a WHERE clause, and parameters for selecting the existent files that match the query's criteria.
+
+    If the query includes text, the joins make the file_text table available for ranking and snippets.
+    """
+    joins = ''
+    clauses = ['files.existent = TRUE']
+    params = []
+    if query.include_text:
+        joins = 'INNER JOIN file_text ON file_text.rowid = files.id'
+        clauses.append('file_text MATCH ?')
+        params.append(_fts_match(query.include_text))
+    if query.include_tags:
+        placeholders = ', '.join('?' for _ in query.include_tags)
+        clauses.append(f'files.id IN (SELECT file_id FROM file_tags WHERE tag IN ({placeholders})'
+                       ' GROUP BY file_id HAVING COUNT(*) = ?)')
+        params.extend(sorted(query.include_tags))
+        params.append(len(query.include_tags))
+    if query.exclude_tags:
+        placeholders = ', '.join('?' for _ in query.exclude_tags)
+        clauses.append(f'NOT EXISTS (SELECT 1 FROM file_tags'
+                       f' WHERE file_tags.file_id = files.id AND file_tags.tag IN ({placeholders}))')
+        params.extend(sorted(query.exclude_tags))
+    return joins, ' AND '.join(clauses), params
+
+
+def _sql_lower(val: Optional[str]) -> Optional[str]:
+    return val and val.lower()
+
+
+def _sql_basename(path: Optional[str]) -> Optional[str]:
+    return path and os.path.basename(path)
+
+
+def _sql_created_key(created: Optional[str]) -> Optional[str]:
+    """Converts a stored created date to a string that sorts the same way as :meth:`FileQuerySort.key`."""
+    if not created:
+        return None
+    try:
+        val = datetime.fromisoformat(created)
+        if not val.tzinfo:
+            val = val.replace(tzinfo=timezone.utc)
+        return val.astimezone(timezone.utc).isoformat(timespec='microseconds')
+    except (ValueError, OverflowError):
+        return None
+
+
+def _sql_order_by(query: FileQuery) -> str:
+    """Returns an ORDER BY clause equivalent to :meth:`FileQuery.apply_sorting` for the query's sort_by."""
+    terms = []
+    for sort in query.sort_by:
+        direction = ' DESC' if sort.reverse else ''
+        missing = None
+        if sort.field == FileQuerySortField.BACKLINKS_COUNT:
+            expr = '(SELECT COUNT(*) FROM file_links WHERE file_links.referent_id = files.id)'
+        elif sort.field == FileQuerySortField.CREATED:
+            expr = 'notesdir_created_key(files.created)'
+            missing = f'{expr} IS NULL'
+        elif sort.field == FileQuerySortField.FILENAME:
+            expr = 'notesdir_basename(files.path)'
+            if sort.ignore_case:
+                expr = f'notesdir_lower({expr})'
+        elif sort.field == FileQuerySortField.PATH:
+            expr = 'notesdir_lower(files.path)' if sort.ignore_case else 'files.path'
+        elif sort.field == FileQuerySortField.TAGS_COUNT:
+            expr = '(SELECT COUNT(*) FROM file_tags WHERE file_tags.file_id = files.id)'
+        elif sort.field == FileQuerySortField.TITLE:
+            expr = 'notesdir_lower(files.title)' if sort.ignore_case else 'files.title'
+            missing = "(files.title IS NULL OR files.title = '')"
+        else:
+            raise ValueError(f'Unsupported sort field: {sort.field}')
+        if missing:
+            # Sorting by this boolean first puts missing values last, or first if we negate it
+            terms.append(f'NOT {missing}{direction}' if sort.missing_first else f'{missing}{direction}')
+        terms.append(f'{expr}{direction}')
+    if query.include_text and not query.sort_by:
+        terms.append('file_text.rank')
+    # Python's sort is stable, so ties keep the order in which files were found; id approximates that.
+    terms.append('files.id')
+    return 'ORDER BY ' + ', '.join(terms)
 
 
 class SqliteRepo(DirectRepo):
@@ -79,9 +323,9 @@ class SqliteRepo(DirectRepo):
     :class:`SqliteRepo` instance. Corrupting or deleting the file during operation may cause erratic behavior, though.
 
     The modification timestamp and other filesystem metadata for each file in your note directories
-    are stored in the database. Each time a :class:`SqliteRepo` instance is created or :meth:`change` is
-    called, the files are scanned to see if this metadata has changed for any of them; if so, those files are parsed
-    again and the cache is updated.
+    are stored in the database. Each time a :class:`SqliteRepo` instance is created, the files are scanned to see if
+    this metadata has changed for any of them; if so, those files are parsed again and the cache is updated.
+    When :meth:`change` is called, just the files it affects are parsed again.
 
     Remember to call :meth:`close` when done with the instance, or use the instance as a context manager.
 
@@ -93,49 +337,242 @@ class SqliteRepo(DirectRepo):
         if not conf.cache_path:
             raise ValueError('`cache_path` must be set in SqliteRepoConf.')
         self.connection = None
+        self._needs_refresh = False
+        self._paths_to_refresh = set()
+        self._invalidated_at = None
+        self._allow_stale = False
         self._connect()
-        self.invalidate()
+        self.invalidate(allow_stale=True)
 
     def _connect(self):
-        self.connection = sqlite3.connect(self.conf.cache_path)
-        self.connection.executescript(_SQL_CREATE_SCHEMA)
+        self.connection = sqlite3.connect(self.conf.cache_path, timeout=_BUSY_TIMEOUT)
+        with self._lock():
+            # In WAL mode, other processes can keep reading the last committed data while one is refreshing the
+            # cache. Switching modes needs an exclusive lock on the database, which the busy timeout does not cover
+            # when other processes are opening it at the same time, so it is done while holding our own lock.
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            if not self.connection.execute('PRAGMA user_version').fetchone()[0] == _SCHEMA_VERSION:
+                self.connection.executescript(_SQL_DROP_SCHEMA)
+                self.connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            self.connection.executescript(_SQL_CREATE_SCHEMA)
+        self.connection.create_function('notesdir_lower', 1, _sql_lower)
+        self.connection.create_function('notesdir_basename', 1, _sql_basename)
+        self.connection.create_function('notesdir_created_key', 1, _sql_created_key)
+        self.connection.execute('CREATE TEMP TABLE missing_ids (id INTEGER PRIMARY KEY)')
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Holds a lock that is shared with other processes using the same cache, while changing the cache.
+
+        This ensures only one process refreshes the cache at a time, and that a process does not make decisions
+        based on data another process is in the middle of changing.
+        """
+        if fcntl is None or self.conf.cache_path == ':memory:':
+            yield
+            return
+        with open(f'{self.conf.cache_path}.lock', 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _rollback_on_error(self) -> Iterator[None]:
+        """Discards uncommitted changes if an error occurs, so that a later commit cannot save them.
+
+        This matters for long-lived instances, such as those used by :func:`notesdir.watch.watch` and
+        :func:`notesdir.server.serve`, which keep using the connection after a refresh fails.
+        """
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def _refresh_started(self) -> Optional[float]:
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (_META_REFRESH_STARTED,)).fetchone()
+        return row and row[0]
 
     def _refresh(self) -> None:
+        started = time.time()
         cursor = self.connection.cursor()
         cursor.execute(_SQL_ALL_FOR_REFRESH)
         prior_rows = (_SqlAllForRefreshRow(*r) for r in cursor.fetchall())
         prior_rows_by_path = {r.path: r for r in prior_rows}
         found_paths = set()
 
-        ids_by_path = {}
-        links_to_add = []
-
-        for path_entry in self._paths():
-            dir_entry = path_entry.dir_entry
-            pathstr = dir_entry.path
+        if self.conf.skip_unchanged_dirs:
+            entries = self._scan_pruned(cursor, prior_rows_by_path)
+        else:
+            cursor.execute('DELETE FROM dirs')
+            entries = ((e.dir_entry.path, e.skip_parse, e.dir_entry.stat) for e in self._paths())
+        to_parse = []
+        for pathstr, skip_parse, stat_fn in entries:
             found_paths.add(pathstr)
-            row = prior_rows_by_path.get(pathstr)
-            if row and path_entry.skip_parse:
-                # TODO currently we do not clear out old data for files that were previously parsable but are now
-                #      marked skip_parse
+            pending = self._check_file(cursor, pathstr, skip_parse, stat_fn, prior_rows_by_path.get(pathstr))
+            if pending:
+                to_parse.append(pending)
+
+        ids_by_path = {path: row.id for path, row in prior_rows_by_path.items()}
+        found_paths.update(self._store_parsed(cursor, to_parse, ids_by_path))
+        self._mark_missing(cursor, [row.id for path, row in prior_rows_by_path.items() if path not in found_paths])
+        cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (_META_REFRESH_STARTED, started))
+
+        self.connection.commit()
+        self._needs_refresh = False
+        self._paths_to_refresh.clear()
+
+    def _scan_pruned(self, cursor: sqlite3.Cursor, prior_rows_by_path: Dict[str, _SqlAllForRefreshRow])\
+            -> Iterator[Tuple[str, bool, Optional[Callable[[], os.stat_result]]]]:
+        """Finds files like :meth:`_paths` does, but without listing directories that have not changed.
+
+        A directory is considered unchanged if its modification time matches the one recorded in the ``dirs`` table
+        when it was last listed. Modification times too close to the start of the refresh are not recorded (see
+        ``_RACY_DIR_INTERVAL``). In that case the files and subdirectories found in it last time are used; the files
+        are only stat-checked if :attr:`notesdir.conf.SqliteRepoConf.unchanged_dir_check_interval` has passed since
+        they were last checked.
+
+        Yields tuples of (path, skip_parse, stat_fn), where stat_fn is None for files that do not need checking.
+        The ``dirs`` table is updated once all paths have been yielded.
+        """
+        now = time.time()
+        cursor.execute('SELECT path, stat_mtime, checked FROM dirs')
+        prior_dirs = {path: (mtime, checked) for path, mtime, checked in cursor.fetchall()}
+        known_files = defaultdict(list)
+        for path, row in prior_rows_by_path.items():
+            if row.existent:
+                known_files[os.path.dirname(path)].append(os.path.basename(path))
+        known_subdirs = defaultdict(list)
+        for path in prior_dirs:
+            known_subdirs[os.path.dirname(path)].append(os.path.basename(path))
+        updated_dirs = []
+        seen_dirs = set()
+
+        def scan(dirpath: str, skip_parse: bool):
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except FileNotFoundError:
+                return
+            seen_dirs.add(dirpath)
+            prior = prior_dirs.get(dirpath)
+            if prior and prior[0] == mtime:
+                check = now - (prior[1] or 0) >= self.conf.unchanged_dir_check_interval
+                if check:
+                    updated_dirs.append((dirpath, mtime, now))
+                for name in known_files[dirpath]:
+                    if not self.conf.ignore(dirpath, name):
+                        path = os.path.join(dirpath, name)
+                        yield (path, skip_parse or self.conf.skip_parse(dirpath, name),
+                               partial(os.stat, path) if check else None)
+                for name in known_subdirs[dirpath]:
+                    if not self.conf.ignore(dirpath, name):
+                        yield from scan(os.path.join(dirpath, name), skip_parse or self.conf.skip_parse(dirpath, name))
+                return
+            # A file created just after os.scandir lists the directory may not change the directory's mtime
+            updated_dirs.append((dirpath, mtime if mtime < now - _RACY_DIR_INTERVAL else None, now))
+            for entry in os.scandir(dirpath):
+                if entry.is_symlink() or self.conf.ignore(dirpath, entry.name):
+                    continue
+                entry_skip_parse = skip_parse or self.conf.skip_parse(dirpath, entry.name)
+                if entry.is_dir():
+                    yield from scan(entry.path, entry_skip_parse)
+                else:
+                    yield entry.path, entry_skip_parse, entry.stat
+
+        for root in self.conf.root_paths:
+            if os.path.isdir(root):
+                parent, basename = os.path.split(root)
+                yield from scan(root, self.conf.skip_parse(parent, basename))
+
+        cursor.executemany('INSERT OR REPLACE INTO dirs (path, stat_mtime, checked) VALUES (?, ?, ?)', updated_dirs)
+        stale_dirs = [p for p in prior_dirs if p not in seen_dirs]
+        for batch in _batches(stale_dirs):
+            cursor.execute(f'DELETE FROM dirs WHERE path IN ({_placeholders(batch)})', batch)
+
+    def _refresh_paths(self, paths: Set[str]) -> None:
+        """Updates the cache for just the given files, and for the contents of the given directories.
+
+        Paths that no longer exist (including the former contents of directories) are handled the same way
+        :meth:`_refresh` handles deleted files.
+        """
+        cursor = self.connection.cursor()
+        prior_rows_by_path = {}
+        for path in paths:
+            cursor.execute(f'{_SQL_ALL_FOR_REFRESH} WHERE path = ? OR (path > ? AND path < ?)',
+                           (path, path + os.sep, path + _SEP_SUCCESSOR))
+            prior_rows_by_path.update((r[1], _SqlAllForRefreshRow(*r)) for r in cursor.fetchall())
+        found_paths = set()
+
+        to_parse = []
+        for path in paths:
+            skip_parse = self.scan_status(path)
+            if skip_parse is None:
                 continue
-            stat = dir_entry.stat()
-            if (row and row.stat_ctime == stat.st_ctime
-                    and row.stat_mtime == stat.st_mtime
-                    and row.stat_size == stat.st_size):
+            if os.path.isdir(path):
+                candidates = ((e.dir_entry.path, e.skip_parse, e.dir_entry.stat)
+                              for e in self._paths_in(path, skip_parse))
+            elif os.path.exists(path):
+                candidates = [(path, skip_parse, partial(os.stat, path))]
+            else:
                 continue
-            info = super().info(pathstr, path_resolved=True, skip_parse=path_entry.skip_parse)
+            for pathstr, entry_skip_parse, stat_fn in candidates:
+                # A file may be listed both on its own and as part of a directory
+                if pathstr in found_paths:
+                    continue
+                found_paths.add(pathstr)
+                pending = self._check_file(cursor, pathstr, entry_skip_parse, stat_fn,
+                                           prior_rows_by_path.get(pathstr))
+                if pending:
+                    to_parse.append(pending)
+
+        # Placeholder rows for link targets may no longer be needed once these files' links are replaced
+        missing_ids = [row.id for path, row in prior_rows_by_path.items() if path not in found_paths]
+        stale_referrer_ids = [p.row.id for p in to_parse if p.row] + missing_ids
+        former_referent_ids = set()
+        for batch in _batches(stale_referrer_ids):
+            cursor.execute('SELECT DISTINCT referent_id FROM file_links'
+                           f' WHERE referrer_id IN ({_placeholders(batch)}) AND referent_id IS NOT NULL',
+                           batch)
+            former_referent_ids.update(r[0] for r in cursor)
+
+        ids_by_path = {path: row.id for path, row in prior_rows_by_path.items()}
+        self._store_parsed(cursor, to_parse, ids_by_path)
+        self._mark_missing(cursor, missing_ids)
+        placeholder_ids = []
+        for batch in _batches(list(former_referent_ids)):
+            cursor.execute(f'SELECT id FROM files WHERE id IN ({_placeholders(batch)}) AND existent = FALSE', batch)
+            placeholder_ids.extend(r[0] for r in cursor)
+        self._mark_missing(cursor, placeholder_ids)
+
+        self.connection.commit()
+
+    def _store_parsed(self, cursor: sqlite3.Cursor, to_parse: List[_PendingParse], ids_by_path: Dict[str, int])\
+            -> Set[str]:
+        """Parses the given files and writes their info to the database.
+
+        ids_by_path should map paths to the IDs of their existing rows, and will be updated with the IDs of new rows.
+        If a link refers to a path not in ids_by_path, its row is looked up, or a placeholder row is inserted.
+
+        Returns the paths that any of the files link to.
+        """
+        links_to_add = []
+        referent_memo = _ReferentMemo()
+        for pending, (info, digest, text) in zip(to_parse, self._parse_all(to_parse)):
+            pathstr, stat, row = pending.path, pending.stat, pending.row
             if row:
                 file_id = row.id
                 cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (file_id,))
                 cursor.execute('DELETE FROM file_links WHERE referrer_id = ?', (file_id,))
+                cursor.execute('DELETE FROM file_text WHERE rowid = ?', (file_id,))
                 updrow = _SqlUpdateFileRow(id=file_id,
                                            existent=True,
                                            stat_ctime=stat.st_ctime,
                                            stat_mtime=stat.st_mtime,
                                            stat_size=stat.st_size,
                                            title=info.title,
-                                           created=info.created)
+                                           created=info.created,
+                                           digest=digest)
                 cursor.execute(_SQL_UPDATE_FILE, updrow)
             else:
                 newrow = _SqlInsertFileRow(path=pathstr,
@@ -144,110 +581,343 @@ class SqliteRepo(DirectRepo):
                                            stat_mtime=stat.st_mtime,
                                            stat_size=stat.st_size,
                                            title=info.title,
-                                           created=info.created)
+                                           created=info.created,
+                                           digest=digest)
                 cursor.execute(_SQL_INSERT_FILE, newrow)
                 file_id = cursor.lastrowid
             cursor.executemany('INSERT INTO file_tags (file_id, tag) VALUES (?, ?)',
                                ((file_id, t) for t in info.tags))
+            if info.title or text:
+                cursor.execute('INSERT INTO file_text (rowid, title, body) VALUES (?, ?, ?)',
+                               (file_id, info.title, text))
             ids_by_path[pathstr] = file_id
-            links_to_add.extend((file_id, link) for link in info.links)
+            links_to_add.extend((file_id, link, referent_memo(link)) for link in info.links)
+
+        referents = {referent for _, _, referent in links_to_add if referent}
+        unknown = [r for r in referents if r not in ids_by_path]
+        for batch in _batches(unknown):
+            cursor.execute(f'SELECT path, id FROM files WHERE path IN ({_placeholders(batch)})', batch)
+            ids_by_path.update(cursor.fetchall())
 
-        for referrer_id, link in links_to_add:
+        for referrer_id, link, referent in links_to_add:
             referent_id = None
-            referent = link.referent()
             if referent:
-                referent_str = str(referent)
-                found_paths.add(referent_str)
-                referent_id = ids_by_path.get(referent_str)
+                referent_id = ids_by_path.get(referent)
                 if not referent_id:
-                    prior_row = prior_rows_by_path.get(referent_str)
-                    if prior_row:
-                        referent_id = prior_row.id
-                if not referent_id:
-                    cursor.execute('INSERT INTO files (path, existent) VALUES (?, FALSE)', (referent_str,))
+                    cursor.execute('INSERT INTO files (path, existent) VALUES (?, FALSE)', (referent,))
                     referent_id = cursor.lastrowid
-                    ids_by_path[referent_str] = referent_id
+                    ids_by_path[referent] = referent_id
             cursor.execute('INSERT INTO file_links (referrer_id, referent_id, href)'
                            ' VALUES (?, ?, ?)',
                            (referrer_id, referent_id, link.href))
-
-        ids_to_delete = [prior_rows_by_path[p].id for p in set(prior_rows_by_path.keys()).difference(found_paths)]
-        for id_to_delete in ids_to_delete:
-            cursor.execute('SELECT COUNT(*) FROM file_links WHERE referent_id = ?', (id_to_delete,))
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('DELETE FROM files WHERE id = ?', (id_to_delete,))
-            else:
-                updrow = _SqlUpdateFileRow(id=id_to_delete,
-                                           existent=False,
-                                           stat_ctime=None,
-                                           stat_mtime=None,
-                                           stat_size=None,
-                                           title=None,
-                                           created=None)
-                cursor.execute(_SQL_UPDATE_FILE, updrow)
-            cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (id_to_delete,))
-            cursor.execute('DELETE FROM file_links WHERE referrer_id = ?', (id_to_delete,))
-
-        self.connection.commit()
-        self._needs_refresh = False
+        return referents
+
+    def _mark_missing(self, cursor: sqlite3.Cursor, ids: List[int]) -> None:
+        """Removes data for files that no longer exist.
+
+        Rows that are still the target of links from other files are kept, but marked nonexistent.
+        This runs a fixed number of statements regardless of how many files are missing.
+        """
+        if not ids:
+            return
+        cursor.executemany('INSERT OR IGNORE INTO missing_ids (id) VALUES (?)', ((i,) for i in ids))
+        for statement in _SQL_MARK_MISSING:
+            cursor.execute(statement)
+
+    def _check_file(self, cursor: sqlite3.Cursor, path: str, skip_parse: bool,
+                    stat_fn: Optional[Callable[[], os.stat_result]], row: Optional[_SqlAllForRefreshRow])\
+            -> Optional[_PendingParse]:
+        """Returns a _PendingParse if the file needs to be (re)parsed, or None if its row is up to date.
+
+        stat_fn may be None for known files that should be assumed unchanged.
+
+        If :attr:`notesdir.conf.SqliteRepoConf.content_digests` is enabled and the file's stat metadata has changed
+        but its contents have not, the row's stat metadata is updated here and None is returned.
+        """
+        if row and (skip_parse or not stat_fn):
+            # TODO currently we do not clear out old data for files that were previously parsable but are now
+            #      marked skip_parse
+            return None
+        stat = stat_fn()
+        if (row and row.stat_ctime == stat.st_ctime
+                and row.stat_mtime == stat.st_mtime
+                and row.stat_size == stat.st_size):
+            return None
+        if (self.conf.content_digests and row and row.digest and row.stat_size == stat.st_size
+                and _file_digest(path) == row.digest):
+            cursor.execute(_SQL_UPDATE_FILE_STAT, (stat.st_ctime, stat.st_mtime, stat.st_size, row.id))
+            return None
+        return _PendingParse(path, skip_parse, stat, row)
+
+    def _parse_all(self, to_parse: List[_PendingParse]) -> Iterator[_ParseResult]:
+        """Parses the given files, yielding their info (and digest and text, if applicable) in the same order.
+
+        If :attr:`notesdir.conf.SqliteRepoConf.parse_workers` allows it, the files are parsed in a pool of
+        processes, while the caller consumes (and writes to the database) the results as they become available.
+        """
+        workers = self.conf.parse_workers or os.cpu_count() or 1
+        if workers <= 1 or len(to_parse) < _MIN_PARALLEL_PARSE:
+            for pending in to_parse:
+                yield _parse_file(self.accessor_factory, pending.path, pending.skip_parse, self.conf.content_digests,
+                                  self._wants_text(pending.path))
+            return
+        paths = [p.path for p in to_parse]
+        skips = [p.skip_parse for p in to_parse]
+        texts = [self._wants_text(p.path) for p in to_parse]
+        chunksize = max(1, len(to_parse) // (workers * 4))
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_parse_file, repeat(self.accessor_factory), paths, skips,
+                                    repeat(self.conf.content_digests), texts, chunksize=chunksize)
 
     def _refresh_if_needed(self) -> None:
-        if self._needs_refresh:
-            self._refresh()
-
-    def invalidate(self, only: Set[str] = None) -> None:
-        # TODO support `only`
-        self._needs_refresh = True
+        if not (self._needs_refresh or self._paths_to_refresh):
+            return
+        with self._lock(), self._rollback_on_error():
+            if self._needs_refresh:
+                # If another process began a full refresh after this instance was invalidated, it will have seen
+                # any changes this one would, so its result can be used instead of scanning again.
+                # The refresh may also be skipped if the cache is recent enough and the caller allows that.
+                window = (self.conf.max_staleness or 0) if self._allow_stale else 0
+                refresh_started = self._refresh_started()
+                if refresh_started is not None and refresh_started > self._invalidated_at - window:
+                    self._needs_refresh = False
+                else:
+                    self._refresh()
+            if self._paths_to_refresh:
+                self._refresh_paths(self._paths_to_refresh)
+                self._paths_to_refresh.clear()
+
+    def invalidate(self, only: Set[str] = None, *, allow_stale: bool = False) -> None:
+        """Schedules a refresh of the cache before the next read.
+
+        If ``only`` is non-empty, only those files (or the contents of those directories) will be checked for
+        changes, unless a full refresh is already pending.
+
+        If ``allow_stale`` is True, a full refresh will be skipped if the cache was refreshed within
+        :attr:`notesdir.conf.SqliteRepoConf.max_staleness` seconds. This is what happens when an instance is created.
+        """
+        if only:
+            self._paths_to_refresh.update(os.path.abspath(p) for p in only)
+        else:
+            self._allow_stale = allow_stale and (self._allow_stale or not self._needs_refresh)
+            self._needs_refresh = True
+            self._invalidated_at = time.time()
 
     def info(self, path: str, fields: FileInfoReqIsh = FileInfoReq.internal(), path_resolved=False) -> FileInfo:
-        self._refresh_if_needed()
         if not path_resolved:
             path = os.path.abspath(path)
         fields = FileInfoReq.parse(fields)
+        if self.conf.lazy_refresh and self._needs_refresh and self._refresh_started() is not None:
+            self._refresh_for_info(path, fields)
+        else:
+            self._refresh_if_needed()
         cursor = self.connection.cursor()
-        cursor.execute('SELECT id, title, created FROM files WHERE path = ?', (path,))
+        cursor.execute('SELECT id, path, title, created FROM files WHERE path = ?', (path,))
         file_row = cursor.fetchone()
-        info = FileInfo(path)
-        if file_row:
-            file_id = file_row[0]
-            info.title = file_row[1]
-            info.created = file_row[2] and datetime.fromisoformat(file_row[2])
+        if not file_row:
+            return FileInfo(path)
+        return next(self._load_infos([file_row], fields))
+
+    def _refresh_for_info(self, path: str, fields: FileInfoReq) -> None:
+        """Updates just the cache entries needed to look up the given file, leaving the full refresh pending."""
+        paths = {path}
+        if fields.backlinks:
+            cursor = self.connection.execute('SELECT referrers.path'
+                                             ' FROM files referrers'
+                                             '  INNER JOIN file_links ON referrers.id = file_links.referrer_id'
+                                             '  INNER JOIN files referents ON referents.id = file_links.referent_id'
+                                             ' WHERE referents.path = ?',
+                                             (path,))
+            paths.update(r for r, in cursor)
+        with self._lock(), self._rollback_on_error():
+            self._refresh_paths(paths)
+        self._paths_to_refresh.difference_update(paths)
+
+    def _load_infos(self, rows: Iterable[tuple], fields: FileInfoReq) -> Iterator[FileInfo]:
+        """Yields a FileInfo for each row of (id, path, title, created) from the files table, in the same order.
+
+        Tags, links, and backlinks are loaded (if requested) for batches of rows at a time, rather than per file.
+        """
+        rows = iter(rows)
+        cursor = self.connection.cursor()
+        while True:
+            batch = list(islice(rows, _SQL_BATCH_SIZE))
+            if not batch:
+                return
+            infos = {}
+            for file_id, path, title, created in batch:
+                infos[file_id] = FileInfo(path, title=title, created=created and datetime.fromisoformat(created))
+            ids = list(infos.keys())
+            placeholders = _placeholders(ids)
             if fields.tags:
-                cursor.execute('SELECT tag FROM file_tags WHERE file_id = ?', (file_id,))
-                info.tags = {r[0] for r in cursor}
+                cursor.execute(f'SELECT file_id, tag FROM file_tags WHERE file_id IN ({placeholders})', ids)
+                for file_id, tag in cursor:
+                    infos[file_id].tags.add(tag)
             if fields.links:
-                cursor.execute('SELECT href FROM file_links WHERE referrer_id = ?', (file_id,))
-                info.links = [LinkInfo(path, href) for href in sorted(r[0] for r in cursor)]
+                cursor.execute('SELECT file_links.referrer_id, file_links.href, referents.path'
+                               ' FROM file_links'
+                               '  LEFT JOIN files referents ON referents.id = file_links.referent_id'
+                               f' WHERE file_links.referrer_id IN ({placeholders})',
+                               ids)
+                for referrer_id, href, referent in cursor:
+                    info = infos[referrer_id]
+                    info.links.append(LinkInfo.resolved(info.path, href, referent))
+                for info in infos.values():
+                    info.links.sort(key=attrgetter('href'))
             if fields.backlinks:
-                cursor.execute('SELECT referrers.path, file_links.href'
+                cursor.execute('SELECT file_links.referent_id, referrers.path, file_links.href'
                                ' FROM files referrers'
                                '  INNER JOIN file_links ON referrers.id = file_links.referrer_id'
-                               ' WHERE file_links.referent_id = ?',
-                               (file_id,))
-                info.backlinks = [LinkInfo(referrer, href) for referrer, href in cursor]
-                info.backlinks.sort(key=attrgetter('referrer', 'href'))
-        return info
+                               f' WHERE file_links.referent_id IN ({placeholders})',
+                               ids)
+                for referent_id, referrer, href in cursor:
+                    referent_info = infos[referent_id]
+                    referent_info.backlinks.append(LinkInfo.resolved(referrer, href, referent_info.path))
+                for info in infos.values():
+                    info.backlinks.sort(key=attrgetter('referrer', 'href'))
+            yield from infos.values()
 
     def query(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
             -> Iterator[FileInfo]:
         self._refresh_if_needed()
         query = FileQuery.parse(query)
+        fields = FileInfoReq.parse(fields)
+        yield from self._load_infos(self._select(query, 'files.id, files.path, files.title, files.created'), fields)
+
+    def search(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
+            -> Iterator[Tuple[FileInfo, Optional[str]]]:
+        self._refresh_if_needed()
+        query = FileQuery.parse(query)
+        fields = FileInfoReq.parse(fields)
+        if not query.include_text:
+            yield from super().search(query, fields)
+            return
+        rows = self._select(query, 'files.id, files.path, files.title, files.created,'
+                                   f" snippet(file_text, -1, '**', '**', '...', {_SNIPPET_TOKENS})").fetchall()
+        infos = self._load_infos((row[:4] for row in rows), fields)
+        yield from zip(infos, (row[4] for row in rows))
+
+    def _select(self, query: FileQuery, columns: str) -> sqlite3.Cursor:
+        """Executes a SELECT of the given columns for the files matching the query, in order."""
+        joins, where, params = _sql_query_filter(query)
         cursor = self.connection.cursor()
-        cursor.execute('SELECT path FROM files WHERE existent = TRUE')
-        # TODO: Obviously, this is super lazy and inefficient. We should do as much filtering and data loading in
-        #       the query as we reasonably can.
-        fields = dataclasses.replace(FileInfoReq.parse(fields),
-                                     tags=(fields.tags or query.include_tags or query.exclude_tags))
-        filtered = query.apply_filtering(self.info(path, fields, path_resolved=True) for (path,) in cursor)
-        yield from query.apply_sorting(filtered)
+        cursor.execute(f'SELECT {columns} FROM files {joins} WHERE {where} {_sql_order_by(query)}'
+                       ' LIMIT ? OFFSET ?',
+                       params + [-1 if query.limit is None else query.limit, query.offset])
+        return cursor
+
+    def tag_counts(self, query: FileQueryIsh = FileQuery()) -> Dict[str, int]:
+        self._refresh_if_needed()
+        query = FileQuery.parse(query)
+        joins, where, params = _sql_query_filter(query)
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT file_tags.tag, COUNT(*)'
+                       f' FROM files {joins} INNER JOIN file_tags ON files.id = file_tags.file_id'
+                       f' WHERE {where}'
+                       ' GROUP BY file_tags.tag',
+                       params)
+        return {tag: count for tag, count in cursor}
 
     def change(self, edits: List[FileEditCmd]):
+        paths = _edited_paths(edits)
+        # invalidate() with no paths would mean the whole cache
+        if not paths:
+            return
         try:
             super().change(edits)
         finally:
-            # TODO only invalidate necessary files
             if not self.conf.preview_mode:
-                self.invalidate()
+                self.invalidate(paths)
+        # Update the cache for the affected files right away, unless a full refresh is pending anyway
+        if not (self.conf.preview_mode or self._needs_refresh):
+            self._refresh_if_needed()
+
+    def refresh(self) -> None:
+        """Brings the cache up to date now, rather than waiting for the next read."""
+        self._refresh_if_needed()
+
+    def mark_up_to_date(self, as_of: float) -> None:
+        """Records that the cache reflects all changes made to files before the given time.
+
+        This is for use by :func:`notesdir.watch.watch`, which learns of changes without scanning for them. Other
+        instances using the same cache will treat it as though a refresh had started at that time.
+        """
+        with self._lock():
+            refresh_started = self._refresh_started()
+            if refresh_started is None or refresh_started < as_of:
+                self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                        (_META_REFRESH_STARTED, as_of))
+                self.connection.commit()
+
+    def rebuild(self) -> None:
+        """Discards the cache and builds it again from scratch.
+
+        This is faster than a refresh when most files need to be parsed anyway, such as when the cache is first
+        created: the new database is filled in large batches, with journaling disabled and without indexes, which are
+        created at the end. It is built in a temporary file and then copied into the cache in a single transaction,
+        so other processes never see a partially built cache.
+        """
+        if self.conf.cache_path == ':memory:':
+            tmp_path = ':memory:'
+        else:
+            tmp_path = f'{self.conf.cache_path}.{os.getpid()}.rebuild'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock():
+            try:
+                connection = sqlite3.connect(tmp_path)
+                try:
+                    connection.execute('PRAGMA journal_mode = OFF')
+                    connection.execute('PRAGMA synchronous = OFF')
+                    connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+                    connection.executescript(_SQL_CREATE_TABLES)
+                    self._build(connection.cursor(), time.time())
+                    connection.executescript(_SQL_CREATE_INDEXES)
+                    connection.commit()
+                    # Unlike replacing the file, this is safe while other processes have the cache open in WAL mode.
+                    self.connection.commit()
+                    connection.backup(self.connection)
+                finally:
+                    connection.close()
+            finally:
+                if not tmp_path == ':memory:' and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._needs_refresh = False
+        self._paths_to_refresh.clear()
+
+    def _build(self, cursor: sqlite3.Cursor, started: float) -> None:
+        """Parses all files and inserts their info into empty tables, using explicit IDs and batched inserts."""
+        cursor.execute('INSERT INTO meta (key, value) VALUES (?, ?)', (_META_REFRESH_STARTED, started))
+        to_parse = [_PendingParse(e.dir_entry.path, e.skip_parse, e.dir_entry.stat(), None) for e in self._paths()]
+        ids_by_path = {pending.path: file_id for file_id, pending in enumerate(to_parse, 1)}
+        referent_memo = _ReferentMemo()
+        results = zip(to_parse, self._parse_all(to_parse))
+        while True:
+            batch = list(islice(results, _SQL_BATCH_SIZE))
+            if not batch:
+                return
+            files, tags, links, texts = [], [], [], []
+            for pending, (info, digest, text) in batch:
+                file_id, stat = ids_by_path[pending.path], pending.stat
+                files.append((file_id, pending.path, True, stat.st_ctime, stat.st_mtime, stat.st_size,
+                              info.title, info.created, digest))
+                tags.extend((file_id, tag) for tag in info.tags)
+                for link in info.links:
+                    referent = referent_memo(link)
+                    referent_id = None
+                    if referent:
+                        referent_id = ids_by_path.get(referent)
+                        if not referent_id:
+                            referent_id = ids_by_path[referent] = len(ids_by_path) + 1
+                            files.append((referent_id, referent, False, None, None, None, None, None, None))
+                    links.append((file_id, referent_id, link.href))
+                if info.title or text:
+                    texts.append((file_id, info.title, text))
+            cursor.executemany(_SQL_INSERT_FILE_WITH_ID, files)
+            cursor.executemany('INSERT INTO file_tags (file_id, tag) VALUES (?, ?)', tags)
+            cursor.executemany('INSERT INTO file_links (referrer_id, referent_id, href) VALUES (?, ?, ?)', links)
+            cursor.executemany('INSERT INTO file_text (rowid, title, body) VALUES (?, ?, ?)', texts)
 
     def clear(self):
         self.connection.executescript(_SQL_CLEAR)
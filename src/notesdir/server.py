@@ -0,0 +1,149 @@
+"""Provides a server that runs CLI commands in a long-lived process, and the client used by the CLI to reach it.
+
+Starting the CLI normally involves loading the configuration file, importing the libraries used to parse files, and
+opening and refreshing the cache. The server (started with ``notesdir serve``) does this once, then listens on a Unix
+domain socket. While it is running, the CLI forwards commands to it instead of running them itself.
+
+Each request is a single line of JSON, ``{"args": [...], "cwd": "..."}``, containing the command-line arguments and
+the client's working directory. The response is a JSON object with the keys ``exit_code``, ``stdout`` and
+``stderr``, after which the server closes the connection.
+"""
+
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+import os.path
+import socket
+import stat
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+# How often to check the stop condition while waiting for connections.
+_ACCEPT_TIMEOUT = 1.0
+
+
+def default_socket_path() -> str:
+    """Returns the ``NOTESDIR_SOCKET`` environment variable if set, or else ``~/.notesdir.sock``."""
+    return os.environ.get('NOTESDIR_SOCKET') or os.path.expanduser(os.path.join('~', '.notesdir.sock'))
+
+
+def _read_message(conn: socket.socket) -> dict:
+    chunks = []
+    while True:
+        chunk = conn.recv(64 * 1024)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def _handle(handler: Callable[[List[str]], int], request: dict) -> dict:
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    original_cwd = os.getcwd()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(request['cwd'])
+            exit_code = handler(request['args'])
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os.chdir(original_cwd)
+    return {'exit_code': exit_code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+
+def serve(path: str, handler: Callable[[List[str]], int], stop: Callable[[], bool] = None) -> None:
+    """Listens on a Unix domain socket at the given path and runs requested commands, until ``stop`` returns True.
+
+    ``handler`` is called with the command-line arguments of each request, and should print output to
+    :data:`sys.stdout` and :data:`sys.stderr` and return the exit code. Requests are handled one at a time.
+
+    If ``stop`` is None, this runs until interrupted. The socket file is removed when the server stops.
+
+    Raises :exc:`FileExistsError` if another server is already listening at the path, or if something other than a
+    socket is there.
+    """
+    probe = _connect(path)
+    if probe:
+        probe.close()
+        raise FileExistsError(f'A server is already listening at {path}')
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        pass
+    else:
+        # A socket left behind by a server that did not shut down cleanly can be replaced, but anything else at the
+        # path (for example, a file that NOTESDIR_SOCKET was pointed at by mistake) must not be deleted.
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f'{path} exists and is not a socket')
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only the current user should be able to run commands against their notes.
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    try:
+        server.listen()
+        server.settimeout(_ACCEPT_TIMEOUT)
+        while not (stop and stop()):
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                try:
+                    conn.settimeout(None)
+                    response = _handle(handler, _read_message(conn))
+                    conn.sendall(json.dumps(response).encode('utf-8'))
+                except Exception:
+                    # A bad request or a client that went away should not stop the server.
+                    traceback.print_exc()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def _connect(path: str) -> Optional[socket.socket]:
+    if not (hasattr(socket, 'AF_UNIX') and os.path.exists(path)):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        # Most likely a server crashed and left the socket file behind.
+        conn.close()
+        return None
+    return conn
+
+
+def forward(args: List[str], path: str) -> Optional[Tuple[int, str, str]]:
+    """Sends a command to the server listening at the given path, and returns its exit code, stdout and stderr.
+
+    Returns None if no server is listening, or if it closes the connection without replying.
+    """
+    conn = _connect(path)
+    if not conn:
+        return None
+    with conn:
+        request = {'args': args, 'cwd': os.getcwd()}
+        conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        conn.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = conn.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    if not chunks:
+        # The server closed the connection without replying, so it is probably shutting down.
+        return None
+    response = json.loads(b''.join(chunks).decode('utf-8'))
+    return response['exit_code'], response['stdout'], response['stderr']
@@ -0,0 +1,243 @@
+"""Provides :func:`watch`, which keeps the cache of a :class:`notesdir.repos.sqlite.SqliteRepo` up to date as
+files change.
+
+File change notifications come from the `watchdog <https://pypi.org/project/watchdog/>`_ package if it is
+installed. Otherwise, on Linux, inotify is used directly.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import os.path
+import queue
+import select
+import struct
+import time
+import traceback
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from notesdir.repos.sqlite import SqliteRepo
+
+DEFAULT_DEBOUNCE = 0.5
+"""Default number of seconds to wait after a file changes, in case more changes follow."""
+
+DEFAULT_MAX_DELAY = 5.0
+"""Default maximum number of seconds to keep waiting for a burst of changes to end before updating the cache."""
+
+# How often to check the stop condition, and to record that the cache is up to date, when nothing is happening.
+_IDLE_INTERVAL = 5.0
+
+# Allowance for the time between a file changing and the notification being received.
+_EVENT_LATENCY = 1.0
+
+
+class Coalescer:
+    """Collects changed paths so that bursts of changes can be handled together.
+
+    A batch becomes ready once no changes have arrived for ``debounce`` seconds, or once the earliest pending change
+    is ``max_delay`` seconds old, whichever comes first.
+
+    Adding None instead of a path indicates that changes may have been missed, and the whole cache should be checked.
+    """
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE, max_delay: float = DEFAULT_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._paths = set()
+        self._rescan = False
+        self._first = None
+        self._last = None
+
+    def add(self, path: Optional[str], now: float) -> None:
+        if path is None:
+            self._rescan = True
+        else:
+            self._paths.add(path)
+        if self._first is None:
+            self._first = now
+        self._last = now
+
+    def timeout(self, now: float) -> Optional[float]:
+        """Returns the number of seconds until a batch will be ready, or None if no changes are pending."""
+        if self._first is None:
+            return None
+        ready_at = min(self._last + self.debounce, self._first + self.max_delay)
+        return max(0.0, ready_at - now)
+
+    def take(self, now: float) -> Optional[Tuple[Set[str], bool]]:
+        """If a batch is ready, returns its paths and whether a rescan is needed, and starts a new batch."""
+        if self._first is None or self.timeout(now) > 0:
+            return None
+        result = (self._paths, self._rescan)
+        self._paths = set()
+        self._rescan = False
+        self._first = None
+        self._last = None
+        return result
+
+
+# Flags from <sys/inotify.h>
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+                  | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class _InotifyWatcher:
+    def __init__(self, roots: Iterable[str], should_watch_dir: Callable[[str], bool]):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init'):
+            raise RuntimeError('The watch command requires the watchdog package on this platform.')
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._should_watch_dir = should_watch_dir
+        self._dirs_by_wd = {}
+        for root in roots:
+            self._add_tree(root)
+
+    def _add_tree(self, dirpath: str) -> None:
+        if not (os.path.isdir(dirpath) and self._should_watch_dir(dirpath)):
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), _IN_WATCH_MASK)
+        if wd < 0:
+            # The directory may have been deleted already; its parent's watch will report that.
+            return
+        self._dirs_by_wd[wd] = dirpath
+        for entry in os.scandir(dirpath):
+            if entry.is_dir(follow_symlinks=False):
+                self._add_tree(entry.path)
+
+    def read(self, timeout: float) -> List[Optional[str]]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                paths.append(None)
+                continue
+            dirpath = self._dirs_by_wd.get(wd)
+            if mask & _IN_IGNORED:
+                self._dirs_by_wd.pop(wd, None)
+                continue
+            if not dirpath:
+                continue
+            path = os.path.join(dirpath, name) if name else dirpath
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+            paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _WatchdogWatcher:
+    def __init__(self, roots: Iterable[str]):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+        self._queue = queue.Queue()
+        handler = FileSystemEventHandler()
+        handler.on_any_event = self._on_event
+        self._observer = Observer()
+        for root in roots:
+            self._observer.schedule(handler, root, recursive=True)
+        self._observer.start()
+
+    def _on_event(self, event) -> None:
+        self._queue.put(os.fsdecode(event.src_path))
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self._queue.put(os.fsdecode(dest_path))
+
+    def read(self, timeout: float) -> List[Optional[str]]:
+        try:
+            paths = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                paths.append(self._queue.get_nowait())
+            except queue.Empty:
+                return paths
+
+    def close(self) -> None:
+        self._observer.stop()
+        self._observer.join()
+
+
+def _update(repo: SqliteRepo, changed: Optional[Set[str]]) -> bool:
+    """Refreshes the given paths, or the whole cache if None, and returns whether that succeeded."""
+    try:
+        repo.invalidate(changed)
+        repo.refresh()
+        return True
+    except Exception:
+        traceback.print_exc()
+        return False
+
+
+def watch(repo: SqliteRepo, debounce: float = DEFAULT_DEBOUNCE, max_delay: float = DEFAULT_MAX_DELAY,
+          stop: Callable[[], bool] = None) -> None:
+    """Updates the repo's cache whenever files in the configured root paths change, until ``stop`` returns True.
+
+    ``stop`` is checked at least every few seconds; if it is None, this runs until interrupted.
+
+    Changes are collected by a :class:`Coalescer` and each batch is applied in a single transaction, so a burst of
+    changes (such as an editor saving repeatedly, or ``git pull``) only updates the cache once. While idle, this
+    periodically records that the cache is up to date, so that other instances with
+    :attr:`notesdir.conf.SqliteRepoConf.max_staleness` set can skip refreshing.
+
+    If updating the cache fails (for example, because a file was only partly written), the error is printed and
+    the whole cache is checked again after the next change.
+    """
+    cache_path = os.path.abspath(repo.conf.cache_path)
+
+    def wanted(path: str) -> bool:
+        return not path.startswith(cache_path) and repo.scan_status(path) is not None
+
+    roots = sorted(repo.conf.root_paths)
+    try:
+        watcher = _WatchdogWatcher(roots)
+    except ImportError:
+        watcher = _InotifyWatcher(roots, wanted)
+    try:
+        # Start watching before refreshing, so that no changes are missed in between.
+        repo.invalidate()
+        repo.refresh()
+        coalescer = Coalescer(debounce, max_delay)
+        # Whether the last attempt to update the cache failed, in which case it is not up to date
+        failed = False
+        while not (stop and stop()):
+            read_started = time.time()
+            timeout = coalescer.timeout(read_started)
+            paths = [p for p in watcher.read(_IDLE_INTERVAL if timeout is None else timeout)
+                     if p is None or wanted(p)]
+            for path in paths:
+                coalescer.add(path, time.time())
+            batch = coalescer.take(time.time())
+            if batch:
+                changed, rescan = batch
+                failed = not _update(repo, None if rescan or failed else changed)
+            elif not (paths or failed) and coalescer.timeout(time.time()) is None:
+                repo.mark_up_to_date(read_started - _EVENT_LATENCY)
+    finally:
+        watcher.close()
@@ -1,7 +1,8 @@
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from bs4 import BeautifulSoup
-from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, LinkInfo
+from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd,\
+    ReplaceHrefsCmd, LinkInfo
 from notesdir.accessors.html import HTMLAccessor
 
 
@@ -39,6 +40,37 @@ def test_info(fs):
                           for href in sorted(['../Another%20Note.md', 'me.html.resources/A%20Picture.png', '#nope'])]
 
 
+def test_info_partial(fs):
+    doc = """<html>
+    <HEAD>
+        <title>Knot</title>
+        <meta name="keywords" content="mind"/>
+    </HEAD>
+    <body><a href="foo.html">link</a></body>
+</html>"""
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents=doc)
+    acc = HTMLAccessor(str(path))
+    assert acc.info('title,tags') == FileInfo(str(path), title='Knot', tags={'mind'})
+    # a full load still happens when needed
+    assert acc.info('links').links == [LinkInfo(str(path), 'foo.html')]
+    assert acc.text() == 'link'
+
+
+def test_text(fs):
+    doc = """<html>
+    <head><title>Not Body Text</title><style>p { color: red; }</style></head>
+    <body>
+        <p>Some <b>body</b> text.</p>
+        <!-- a comment -->
+        <script>var x = 1;</script>
+    </body>
+</html>"""
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents=doc)
+    assert HTMLAccessor(str(path)).text() == 'Some body text.'
+
+
 def test_change_from_missing_attributes(fs):
     doc = """<html>
     <body>Hi!</body>
@@ -98,6 +130,17 @@ def test_change(fs):
     assert BeautifulSoup(path.read_text(), 'lxml',) == BeautifulSoup(expected, 'lxml')
 
 
+def test_replace_hrefs(fs):
+    doc = '<html><body><a href="one.md">1</a><a href="two.md">2</a><video src="one.md"></video></body></html>'
+    expected = '<html><body><a href="two.md">1</a><a href="one.md">2</a><video src="two.md"></video></body></html>'
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents=doc)
+    acc = HTMLAccessor(str(path))
+    acc.edit(ReplaceHrefsCmd(str(path), {'one.md': 'two.md', 'two.md': 'one.md'}))
+    assert acc.save()
+    assert BeautifulSoup(path.read_text(), 'lxml') == BeautifulSoup(expected, 'lxml')
+
+
 def test_change_tags(fs):
     doc = """<html>
     <head>
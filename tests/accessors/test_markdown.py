@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from notesdir.models import AddTagCmd, DelTagCmd, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, LinkInfo
-from notesdir.accessors.markdown import _extract_meta, _extract_hrefs, _extract_hashtags, _replace_href,\
-    MarkdownAccessor
+import gc
+import random
+import time
+from notesdir.models import AddTagCmd, DelTagCmd, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, ReplaceHrefsCmd,\
+    LinkInfo, FileInfo
+from notesdir.accessors.markdown import _extract_meta, _extract_hrefs, _extract_hashtags,\
+    _split, _scan, TAG_RE, YAML_META_RE, MarkdownAccessor
 
 
 def test_extract_meta_none():
@@ -42,17 +46,26 @@ An ![image link](/foo/my.png)"""
     assert _extract_hrefs(doc) == expected
 
 
-def test_replace_href_inline():
+def _replace_href(fs, doc, src, dest):
+    path = '/fakenotes/test.md'
+    fs.create_file(path, contents=doc)
+    acc = MarkdownAccessor(path)
+    acc.edit(ReplaceHrefCmd(path, src, dest))
+    acc.save()
+    return Path(path).read_text()
+
+
+def test_replace_href_inline(fs):
     doc = """A link to [some file](some-file) followed by
 a link to [another file](another-file) and
 [the first file again](some-file)."""
     expected = """A link to [some file](new-ref) followed by
 a link to [another file](another-file) and
 [the first file again](new-ref)."""
-    assert _replace_href(doc, 'some-file', 'new-ref') == expected
+    assert _replace_href(fs, doc, 'some-file', 'new-ref') == expected
 
 
-def test_replace_href_refstyle():
+def test_replace_href_refstyle(fs):
     doc = """Here we see the ref style syntax:
 [some id]: file-1 "Some Text"
 [other id]: file-1
@@ -63,21 +76,21 @@ Ignored in the middle of a line: [some id]: file-1"""
 [other id]: new-ref
 [third id]: file-2
 Ignored in the middle of a line: [some id]: file-1"""
-    assert _replace_href(doc, 'file-1', 'new-ref') == expected
+    assert _replace_href(fs, doc, 'file-1', 'new-ref') == expected
 
 
-def test_replace_href_image():
+def test_replace_href_image(fs):
     doc = "An ![image link](http://example.com/foo.png) should work too."
     expected = "An ![image link](http://example.com/bar.png) should work too."
-    assert _replace_href(doc, 'http://example.com/foo.png', 'http://example.com/bar.png') == expected
+    assert _replace_href(fs, doc, 'http://example.com/foo.png', 'http://example.com/bar.png') == expected
 
 
-def test_replace_href_replacement_string_special_characters():
+def test_replace_href_replacement_string_special_characters(fs):
     doc = """A [link](foo.md).
 [refstyle]: foo.md"""
     expected = """A [link](2-foo\\3.md).
 [refstyle]: 2-foo\\3.md"""
-    assert _replace_href(doc, 'foo.md', '2-foo\\3.md') == expected
+    assert _replace_href(fs, doc, 'foo.md', '2-foo\\3.md') == expected
 
 
 def test_info(fs):
@@ -103,6 +116,40 @@ published about online (see [this article](http://example.com/blah) among many o
     assert info.created == datetime(2019, 6, 4, 10, 12, 13, 0, timezone(timedelta(hours=-8)))
 
 
+def test_info_partial(fs):
+    docs = [
+        '---\ntitle: Hi\ncreated: 2019-06-04 10:12:13\n...\n#tag [link](foo.md)',
+        '---\n\n---\ntitle: Hi\n---\n#tag',
+        '---\ntitle: Hi\n---  \n',
+        '---\ntitle: Hi\n---',
+        'title: Hi\n#tag',
+        '',
+    ]
+    path = '/fakenotes/test.md'
+    fs.create_file(path)
+    for doc in docs:
+        Path(path).write_text(doc)
+        full = MarkdownAccessor(path).info()
+        partial = MarkdownAccessor(path).info('title,created')
+        assert partial == FileInfo(path, title=full.title, created=full.created), doc
+    assert MarkdownAccessor(path).info('tags,title') == MarkdownAccessor(path).info()
+
+
+def test_text(fs):
+    doc = """---
+title: Not Body Text
+...
+Some *body* text.
+
+```
+code
+```
+"""
+    path = '/fakenotes/test.md'
+    fs.create_file(path, contents=doc)
+    assert MarkdownAccessor(path).text() == 'Some *body* text.\n\n```\ncode\n```\n'
+
+
 def test_change(fs):
     doc = """---
 title: An Examination of the Navel
@@ -286,3 +333,127 @@ body
         acc.edit(SetTitleCmd(path, 'new title'))
         acc.save()
         assert Path(path).read_text() == expected
+
+
+def _check_scan(doc):
+    # Random docs may not contain valid YAML, so compare the regex groups rather than using _extract_meta
+    match = YAML_META_RE.match(doc)
+    body = match.group(4)
+    parts = _split(body)
+    expected_hrefs = []
+    expected_hashtags = []
+    for parsable, part in parts:
+        if parsable:
+            expected_hrefs.extend(_extract_hrefs(part))
+            expected_hashtags.extend(t[1] for t in TAG_RE.findall(part))
+
+    tokens = list(_scan(doc))
+    assert [t.start for t in tokens] == sorted(t.start for t in tokens)
+    meta_tokens = [t for t in tokens if t.kind == 'meta']
+    assert (meta_tokens[0].value if meta_tokens else '') == (match.group(2) or '')
+    body_start = meta_tokens[0].end if meta_tokens else 0
+    assert doc[body_start:] == body
+    code = [doc[t.start:t.end] for t in tokens if t.kind == 'code']
+    assert code == [part for parsable, part in parts if not parsable]
+    hrefs = [t.value for t in tokens if t.kind == 'href']
+    assert sorted(hrefs) == sorted(expected_hrefs)
+    assert all(doc[t.start:t.end] == t.value for t in tokens if t.kind in ('href', 'hashtag'))
+    assert sorted(t.value for t in tokens if t.kind == 'hashtag') == sorted(expected_hashtags)
+
+
+def test_scan_matches_regexes():
+    docs = [
+        '',
+        '---\n',
+        '---\n---\n',
+        '---\n\n---\n',
+        '---\ntitle: x\n...  \t\n\nbody #tag',
+        '---\ntitle: x\n--- trailing\nbody',
+        '---\ntitle: x\n---',
+        '#start #Mixed-Case_1 mid#not #2no #ok.\n#end_',
+        '#a#b #c- #d--e #é #xé',
+        '[a](b) [c] (d) [e](f g) [h]( i) [j](k)l) [m](n)(o)',
+        '[a][b](c) [[d](e)](f)\n[g](\nh)',
+        '[ref]: one\n [notref]: two\n[ref2]:\n\n  three four\n[ref3]:',
+        'text\n```\n[a](b) #c\n```\n[d](e)\n  ```py\n#f\n  ```x #g',
+        '\n\n```\nunterminated [a](b) #c',
+        '```\n``` ```\n```\n#tag',
+        '---\ntitle: x\n---\n```\ncode\n```',
+        '---\ntitle: x\n---\n#first [a]: #b\n```\n```#after [c](d)\n[e]:\n\n```\n```',
+        '[a]:\n  ```\nunterminated\n[b]: c',
+        '[a [b](c) [d]](e) [f](g)h) [i]\n(j) [k](l m)',
+        '[a](b)[c](d)e)[f](()[g](h\t)i) [j](k](l))',
+    ]
+    rand = random.Random(0)
+    alphabet = ['[', ']', '(', ')', ':', '#', '```', '---', '...', '\n', ' ', '\t', 'a', 'B', '1', '-', '_', '.']
+    for _ in range(2000):
+        docs.append(''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 40))))
+        docs.append('---\n' + docs[-1])
+    for doc in docs:
+        _check_scan(doc)
+
+
+def test_scan_linear_time():
+    def best_time(doc):
+        times = []
+        for _ in range(5):
+            # Collections triggered by the tokens being allocated would add noise
+            gc.disable()
+            try:
+                start = time.process_time()
+                list(_scan(doc))
+                times.append(time.process_time() - start)
+            finally:
+                gc.enable()
+        return min(times)
+
+    # Each of these made an earlier version of the scanner, or the regexes, take quadratic time
+    for make_doc in [lambda n: '[x ' * n + '](y', lambda n: '[a](b)' * n, lambda n: '[' * n + '](',
+                     lambda n: '[' + '](a' * n, lambda n: 'x [a] ' * n]:
+        small, large = best_time(make_doc(2000)), best_time(make_doc(32000))
+        # Multiplying the size by 16 would multiply the time by 256 if it were quadratic
+        assert large < small * 64
+
+
+def test_body_edits_preserve_meta(fs):
+    doc = """---
+# A comment that would be lost by reserializing
+title:   Spacing Preserved
+keywords: [b, a]
+...
+
+
+A [link](a.md) and a #tag, then [another](b.md)."""
+    path = '/fakenotes/test.md'
+    fs.create_file(path, contents=doc)
+    acc = MarkdownAccessor(path)
+    acc.edit(ReplaceHrefCmd(path, 'a.md', 'c.md'))
+    acc.edit(ReplaceHrefCmd(path, 'c.md', 'd.md'))
+    acc.edit(DelTagCmd(path, 'tag'))
+    assert acc.info().links == [LinkInfo(path, 'b.md'), LinkInfo(path, 'd.md')]
+    assert acc.save()
+    expected = doc.replace('a.md', 'd.md').replace('#tag', '')
+    assert Path(path).read_text() == expected
+
+    # The accessor can still be used after saving
+    acc.edit(ReplaceHrefCmd(path, 'b.md', 'e.md'))
+    assert acc.save()
+    assert Path(path).read_text() == expected.replace('b.md', 'e.md')
+
+
+def test_replace_hrefs(fs):
+    doc = """[a](a.md) [b](b.md) [c](c.md)
+[ref]: a.md
+```
+[a](a.md)
+```"""
+    path = '/fakenotes/test.md'
+    fs.create_file(path, contents=doc)
+    acc = MarkdownAccessor(path)
+    acc.edit(ReplaceHrefsCmd(path, {'a.md': 'b.md', 'b.md': 'a.md', 'c.md': 'c.md'}))
+    assert acc.save()
+    assert Path(path).read_text() == """[a](b.md) [b](a.md) [c](c.md)
+[ref]: b.md
+```
+[a](a.md)
+```"""
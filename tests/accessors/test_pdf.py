@@ -15,6 +15,12 @@ def test_info(fs):
     assert info.tags == {'tag1', 'tag2'}
 
 
+def test_text(fs):
+    path = str(Path(__file__).parent.joinpath('test.pdf'))
+    fs.add_real_file(path)
+    assert 'I like donuts' in PDFAccessor(path).text()
+
+
 def test_change(fs):
     path = str(Path(__file__).parent.joinpath('test.pdf'))
     fs.add_real_file(path, read_only=False)
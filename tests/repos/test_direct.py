@@ -41,6 +41,33 @@ def test_referrers_self(fs):
     assert info.backlinks == [LinkInfo('/notes/subject.md', 'subject.md')]
 
 
+def test_backlinks_index(fs, mocker):
+    fs.create_file('/notes/one.md', contents='[1](two.md) [2](dir/three.md)')
+    fs.create_file('/notes/two.md', contents='[1](one.md)')
+    fs.create_file('/notes/dir/three.md', contents='[1](../two.md)')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    assert [link.referrer for link in repo.info('/notes/two.md', FileInfoReq.full()).backlinks] == \
+           ['/notes/dir/three.md', '/notes/one.md']
+    spy = mocker.spy(repo, 'accessor_factory')
+    assert [link.referrer for link in repo.info('/notes/one.md', 'backlinks').backlinks] == ['/notes/two.md']
+    assert not spy.called
+
+    repo.change([ReplaceHrefCmd('/notes/two.md', 'one.md', 'dir/three.md')])
+    assert not repo.info('/notes/one.md', 'backlinks').backlinks
+    assert [link.referrer for link in repo.info('/notes/dir/three.md', 'backlinks').backlinks] == \
+           ['/notes/one.md', '/notes/two.md']
+
+    repo.change([MoveCmd('/notes/dir', '/notes/moved')])
+    assert [link.referrer for link in repo.info('/notes/two.md', 'backlinks').backlinks] == \
+           ['/notes/moved/three.md', '/notes/one.md']
+
+    # changes made by other means are not seen until invalidated
+    Path('/notes/two.md').write_text('[1](one.md)')
+    assert not repo.info('/notes/one.md', 'backlinks').backlinks
+    repo.invalidate({'/notes/two.md'})
+    assert [link.referrer for link in repo.info('/notes/one.md', 'backlinks').backlinks] == ['/notes/two.md']
+
+
 def test_change(fs):
     fs.create_file('/notes/one.md', contents='[1](old)')
     fs.create_file('/notes/two.md', contents='[2](foo)')
@@ -96,6 +123,30 @@ def test_query(fs):
     assert [os.path.basename(i.path) for i in repo.query('sort:filename')] == ['one.md', 'three.md', 'two.md']
 
 
+def test_query_fields(fs, mocker):
+    fs.create_file('/notes/one.md', contents='[2](two.md) #tag1')
+    fs.create_file('/notes/two.md', contents='#tag2')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    spy = mocker.spy(repo, 'accessor_factory')
+    assert sorted(i.path for i in repo.query(fields='path')) == ['/notes/one.md', '/notes/two.md']
+    assert not spy.called
+    assert [i.path for i in repo.query('tag:tag2', 'path')] == ['/notes/two.md']
+    assert [i.path for i in repo.query('sort:-backlinks', 'path')] == ['/notes/two.md', '/notes/one.md']
+
+
+def test_query_text(fs):
+    fs.create_file('/notes/one.md', contents='---\ntitle: Donuts\n...\nI like ice cream.')
+    fs.create_file('/notes/two.md', contents='Cream, ice, and donuts!')
+    fs.create_file('/notes/three.html', contents='<html><body>Ice-cream <b>donuts</b></body></html>')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    paths = {i.path for i in repo.query(FileQuery.parse('text:DONUTS'))}
+    assert paths == {'/notes/one.md', '/notes/two.md', '/notes/three.html'}
+    paths = {i.path for i in repo.query(FileQuery.parse('text:ice+cream text:donuts'))}
+    assert paths == {'/notes/one.md', '/notes/three.html'}
+    assert not list(repo.query(FileQuery.parse('text:ice+donuts')))
+    assert not list(repo.query(FileQuery.parse('text:donut')))
+
+
 def test_tag_counts(fs):
     fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2')
     fs.create_file('/notes/two.md', contents='#tag1 #tag3')
@@ -111,10 +162,14 @@ def test_ignore(fs):
     fs.create_file(path1, contents='I link to [two](.two.md)')
     fs.create_file(path2, contents='I link to [one](one.md)')
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    assert repo.scan_status(path1) is False
+    assert repo.scan_status(path2) is None
+    assert repo.scan_status('/elsewhere/one.md') is None
     assert list(repo.query()) == [repo.info(path1)]
     assert not repo.info(path1, FileInfoReq.full()).backlinks
     assert repo.info(path2, FileInfoReq.full()).backlinks == [LinkInfo(path1, '.two.md')]
     repo.conf.ignore = lambda _1, _2: False
+    repo.invalidate()
     assert list(repo.query()) == [repo.info(path1), repo.info(path2)]
     assert repo.info(path1, FileInfoReq.full()).backlinks == [LinkInfo(path2, 'one.md')]
     assert repo.info(path2, FileInfoReq.full()).backlinks == [LinkInfo(path1, '.two.md')]
@@ -134,6 +189,7 @@ def test_skip_parse(fs):
         return filename.endswith('.resources') or filename == 'skip.md'
 
     repo = DirectRepoConf(root_paths={'/notes'}, skip_parse=fn).instantiate()
+    assert [repo.scan_status(p) for p in (path1, path2, path3, path4)] == [False, True, True, False]
     assert list(repo.query('sort:path')) == [
         FileInfo(path1, title='Note One'),
         FileInfo(path2),
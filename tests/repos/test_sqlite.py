@@ -1,7 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import os
 from pathlib import Path
-from notesdir.models import FileInfo, FileQuery, SetTitleCmd, ReplaceHrefCmd, MoveCmd, FileInfoReq, LinkInfo
+import sqlite3
+import time
+
+import pytest
+
+from notesdir.models import FileInfo, FileQuery, SetTitleCmd, ReplaceHrefCmd, MoveCmd, FileInfoReq, LinkInfo,\
+    AddTagCmd
 from notesdir.conf import SqliteRepoConf
+from notesdir.repos import sqlite
 
 
 def config():
@@ -68,6 +77,42 @@ def test_invalidate(fs):
     assert repo.info(path, FileInfoReq.full()) == FileInfo(path, tags={'goodbye'})
 
 
+def test_invalidate_only(fs):
+    fs.create_file('/notes/one.md', contents='#one [two](two.md) [three](dir/three.md)')
+    fs.create_file('/notes/dir/three.md', contents='#three')
+    fs.create_file('/notes/untouched.md', contents='#untouched')
+    repo = config().instantiate()
+    assert repo.info('/notes/two.md', FileInfoReq.full()) == FileInfo(
+        '/notes/two.md', backlinks=[LinkInfo('/notes/one.md', 'two.md')])
+
+    Path('/notes/one.md').write_text('#changed [four](four.md) [three](dir/three.md)')
+    fs.create_file('/notes/two.md', contents='#two')
+    fs.create_file('/notes/dir/five.md', contents='#five')
+    Path('/notes/untouched.md').write_text('#modified')
+    repo.invalidate({'/notes/one.md', '/notes/two.md', '/notes/dir'})
+    assert repo.tag_counts() == {'changed': 1, 'two': 1, 'three': 1, 'five': 1, 'untouched': 1}
+    assert repo.info('/notes/two.md', FileInfoReq.full()) == FileInfo('/notes/two.md', tags={'two'})
+    assert repo.info('/notes/four.md', FileInfoReq.full()) == FileInfo(
+        '/notes/four.md', backlinks=[LinkInfo('/notes/one.md', 'four.md')])
+    assert repo.connection.execute('SELECT path FROM files WHERE existent = FALSE').fetchall() == [
+        ('/notes/four.md',)]
+
+    fs.remove_object('/notes/dir/three.md')
+    fs.remove_object('/notes/one.md')
+    repo.invalidate({'/notes/dir/three.md', '/notes/one.md'})
+    assert repo.tag_counts() == {'two': 1, 'five': 1, 'untouched': 1}
+    assert repo.connection.execute('SELECT path FROM files ORDER BY path').fetchall() == [
+        ('/notes/dir/five.md',), ('/notes/two.md',), ('/notes/untouched.md',)]
+
+    repo.invalidate()
+    assert repo.tag_counts() == {'two': 1, 'five': 1, 'modified': 1}
+
+    # a new directory and a file in it may both be reported as changed
+    fs.create_file('/notes/sub/six.md', contents='#six')
+    repo.invalidate({'/notes/sub', '/notes/sub/six.md'})
+    assert repo.tag_counts() == {'two': 1, 'five': 1, 'modified': 1, 'six': 1}
+
+
 def test_query(fs):
     fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2 #tag4')
     fs.create_file('/notes/two.md', contents='#tag1 #tag3')
@@ -91,6 +136,373 @@ def test_query(fs):
     assert [Path(i.path).name for i in repo.query('sort:filename')] == ['one.md', 'three.md', 'two.md']
 
 
+def test_query_statement_count(fs):
+    for i in range(20):
+        fs.create_file(f'/notes/{i}.md', contents=f'#tag{i % 2} [next]({i + 1}.md)')
+    repo = config().instantiate()
+    list(repo.query())
+    statements = []
+    repo.connection.set_trace_callback(statements.append)
+    infos = list(repo.query('tag:tag1', FileInfoReq.full()))
+    assert len(infos) == 10
+    assert infos[0].links == [LinkInfo(infos[0].path, f'{int(infos[0].path[7:-3]) + 1}.md')]
+    assert len(infos[0].backlinks) == 1
+    assert len(statements) == 4
+
+
+def test_query_sort_and_limit(fs):
+    fs.create_file('/notes/a.md', contents='---\ntitle: beta\ncreated: 2012-01-09 00:00:00+05:00\n...\n#x')
+    fs.create_file('/notes/B.md', contents='---\ntitle: Alpha\ncreated: 2012-01-08 22:00:00\n...\n[1](a.md)')
+    fs.create_file('/notes/c.md', contents='---\ntitle: \u00c9clair\n...\n#x #y [1](a.md) [2](B.md)')
+    fs.create_file('/notes/d.md', contents='no metadata')
+    repo = config().instantiate()
+    everything = list(repo.query(fields=FileInfoReq.full()))
+    sorts = ['path', 'filename', 'title', 'created', 'tags', 'backlinks']
+    for sortstr in sorts + [f'-{s}' for s in sorts] + ['created,-title', '-backlinks,filename']:
+        query = FileQuery.parse(f'sort:{sortstr}')
+        assert [i.path for i in repo.query(query)] == [i.path for i in query.apply_sorting(everything)], sortstr
+        for sort in query.sort_by:
+            sort.missing_first = True
+            sort.ignore_case = False
+        assert [i.path for i in repo.query(query)] == [i.path for i in query.apply_sorting(everything)], sortstr
+
+    assert [i.path for i in repo.query('sort:-backlinks limit:2')] == ['/notes/a.md', '/notes/B.md']
+    assert [i.path for i in repo.query('sort:path limit:2 offset:1')] == ['/notes/B.md', '/notes/c.md']
+    assert [i.path for i in repo.query('sort:path offset:3')] == ['/notes/d.md']
+
+
+def test_parallel_parse(tmp_path):
+    notes = tmp_path / 'notes'
+    for i in range(40):
+        path = notes / f'dir{i % 3}' / f'{i}.md'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'---\ntitle: Note {i}\n...\n#tag{i % 5} [next](../dir{(i + 1) % 3}/{i + 1}.md)')
+
+    def dump(workers):
+        conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / f'{workers}.sqlite3'),
+                              parse_workers=workers)
+        with conf.instantiate() as repo:
+            repo.tag_counts()
+            return [list(repo.connection.execute(f'SELECT * FROM {table} ORDER BY rowid'))
+                    for table in ['files', 'file_tags', 'file_links']]
+
+    assert dump(4) == dump(1)
+
+
+def _dump_by_path(repo):
+    return [
+        list(repo.connection.execute('SELECT path, existent, title, created FROM files ORDER BY path')),
+        list(repo.connection.execute('SELECT files.path, tag FROM file_tags JOIN files ON files.id = file_id'
+                                     ' ORDER BY 1, 2')),
+        list(repo.connection.execute('SELECT referrers.path, referents.path, href FROM file_links'
+                                     ' JOIN files referrers ON referrers.id = referrer_id'
+                                     ' LEFT JOIN files referents ON referents.id = referent_id'
+                                     ' ORDER BY 1, 2, 3')),
+        list(repo.connection.execute('SELECT files.path, file_text.title, body FROM file_text'
+                                     ' JOIN files ON files.id = file_text.rowid ORDER BY 1')),
+    ]
+
+
+def test_rebuild(tmp_path):
+    notes = tmp_path / 'notes'
+    for i in range(40):
+        path = notes / f'dir{i % 3}' / f'{i}.md'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'---\ntitle: Note {i}\n...\n#tag{i % 5} [next](../dir{(i + 1) % 3}/{i + 1}.md)'
+                        ' [web](http://example.com) [self](#top)')
+    conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / 'cache.sqlite3'))
+    with conf.instantiate() as repo:
+        repo.refresh()
+        expected = _dump_by_path(repo)
+        repo.rebuild()
+        assert _dump_by_path(repo) == expected
+        (notes / 'dir0' / '0.md').unlink()
+        repo.rebuild()
+        assert repo.tag_counts() == {'tag0': 7, 'tag1': 8, 'tag2': 8, 'tag3': 8, 'tag4': 8}
+        assert [i.path for i in repo.query('text:note+39')] == [str(notes / 'dir0' / '39.md')]
+        # the rebuilt cache should be updated normally afterward
+        (notes / 'dir0' / '0.md').write_text('#tag0')
+        repo.invalidate()
+        assert repo.tag_counts() == {'tag0': 8, 'tag1': 8, 'tag2': 8, 'tag3': 8, 'tag4': 8}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.rebuild')]
+    connection = sqlite3.connect(str(tmp_path / 'cache.sqlite3'))
+    assert connection.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    assert connection.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    connection.close()
+
+
+def test_clear(fs):
+    fs.create_file('/notes/one.md', contents='#tag [link](two.md) hello')
+    repo = config().instantiate()
+    assert repo.tag_counts() == {'tag': 1}
+    repo.clear()
+    assert not repo.connection.execute('SELECT * FROM files').fetchall()
+    assert repo.tag_counts() == {'tag': 1}
+    assert [i.path for i in repo.query('text:hello')] == ['/notes/one.md']
+
+
+def test_pdf_text_error(fs, mocker, capsys):
+    fs.add_real_file(Path(__file__).parent.parent / 'accessors' / 'test.pdf', target_path='/notes/one.pdf')
+    fs.create_file('/notes/two.md', contents='#two donuts')
+    mocker.patch('PyPDF4.pdf.PageObject.extractText', side_effect=KeyError('/Contents'))
+    conf = config()
+    conf.pdf_text = True
+    repo = conf.instantiate()
+    assert repo.tag_counts() == {'tag1': 1, 'tag2': 1, 'two': 1}
+    assert repo.info('/notes/one.pdf').title == 'Test PDF'
+    assert [i.path for i in repo.query('text:donuts')] == ['/notes/two.md']
+    assert '/notes/one.pdf' in capsys.readouterr().err
+
+
+def test_refresh_reused_across_instances(tmp_path, mocker):
+    (tmp_path / 'one.md').write_text('#one')
+    conf = SqliteRepoConf(root_paths={str(tmp_path)}, cache_path=str(tmp_path / '.cache.sqlite3'))
+    with conf.instantiate() as repo1, conf.instantiate() as repo2:
+        assert repo1.connection.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+        assert repo2.tag_counts() == {'one': 1}
+        spy = mocker.spy(repo1, '_refresh')
+        assert repo1.tag_counts() == {'one': 1}
+        assert not spy.called
+
+        (tmp_path / 'two.md').write_text('#two')
+        repo1.invalidate()
+        repo2.invalidate()
+        repo2.refresh()
+        assert repo1.tag_counts() == {'one': 1, 'two': 1}
+        assert not spy.called
+
+        (tmp_path / 'three.md').write_text('#three')
+        repo1.invalidate()
+        assert repo1.tag_counts() == {'one': 1, 'two': 1, 'three': 1}
+        assert spy.call_count == 1
+
+
+def test_max_staleness(tmp_path, mocker):
+    (tmp_path / 'one.md').write_text('#one')
+    conf = SqliteRepoConf(root_paths={str(tmp_path)}, cache_path=str(tmp_path / '.cache.sqlite3'))
+    with conf.instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1}
+    (tmp_path / 'two.md').write_text('#two')
+
+    conf.max_staleness = 60
+    with conf.instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1}
+        repo.invalidate()
+        assert repo.tag_counts() == {'one': 1, 'two': 1}
+    (tmp_path / 'three.md').write_text('#three')
+
+    mocker.patch('time.time', return_value=time.time() + 61)
+    with conf.instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1, 'two': 1, 'three': 1}
+
+
+def test_lazy_refresh(fs, mocker):
+    fs.create_file('/notes/one.md', contents='#one')
+    fs.create_file('/notes/two.md', contents='[1](one.md)')
+    fs.create_file('/notes/three.md', contents='[1](one.md)')
+    conf = config()
+    conf.lazy_refresh = True
+    repo = conf.instantiate()
+    assert [link.referrer for link in repo.info('/notes/one.md', FileInfoReq.full()).backlinks] == \
+           ['/notes/three.md', '/notes/two.md']
+
+    spy = mocker.spy(repo, '_refresh')
+    Path('/notes/one.md').write_text('#uno')
+    Path('/notes/two.md').write_text('no links')
+    fs.create_file('/notes/four.md', contents='[1](one.md)')
+    repo.invalidate()
+    info = repo.info('/notes/one.md', FileInfoReq.full())
+    assert info.tags == {'uno'}
+    assert [link.referrer for link in info.backlinks] == ['/notes/three.md']
+    assert not spy.called
+
+    assert {i.path for i in repo.query()} == {'/notes/one.md', '/notes/two.md', '/notes/three.md', '/notes/four.md'}
+    assert spy.call_count == 1
+    assert [link.referrer for link in repo.info('/notes/one.md', FileInfoReq.full()).backlinks] == \
+           ['/notes/four.md', '/notes/three.md']
+
+
+def test_lazy_refresh_error(fs, mocker):
+    fs.create_file('/notes/one.md', contents='#one')
+    conf = config()
+    conf.lazy_refresh = True
+    repo = conf.instantiate()
+    assert repo.tag_counts() == {'one': 1}
+    Path('/notes/one.md').write_text('#uno')
+    repo.invalidate()
+    mark_missing = mocker.patch.object(repo, '_mark_missing', side_effect=OSError('simulated'))
+    with pytest.raises(OSError):
+        repo.info('/notes/one.md')
+    # the rows written before the error must not be committed by whatever uses the connection next
+    assert not repo.connection.in_transaction
+    mark_missing.side_effect = None
+    assert repo.info('/notes/one.md').tags == {'uno'}
+
+
+def _count_tags(conf):
+    with conf.instantiate() as repo:
+        return repo.tag_counts()
+
+
+def test_concurrent_refresh(tmp_path):
+    for i in range(50):
+        (tmp_path / f'{i}.md').write_text(f'#tag{i % 2}')
+    conf = SqliteRepoConf(root_paths={str(tmp_path)}, cache_path=str(tmp_path / '.cache.sqlite3'))
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_count_tags, [conf] * 8))
+    assert results == [{'tag0': 25, 'tag1': 25}] * 8
+
+
+def test_skip_unchanged_dirs(tmp_path):
+    notes = tmp_path / 'notes'
+    (notes / 'dir').mkdir(parents=True)
+    (notes / 'dir' / 'one.md').write_text('#one')
+    (notes / 'two.md').write_text('#two')
+    # directories modified just before a refresh are listed again by the next one, so make these old enough to trust
+    for path in (notes, notes / 'dir'):
+        os.utime(path, (1000, 1000))
+    conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / 'cache.sqlite3'),
+                          skip_unchanged_dirs=True, unchanged_dir_check_interval=1000)
+    with conf.instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1, 'two': 1}
+        # modifying a file does not change its directory's mtime
+        (notes / 'dir' / 'one.md').write_text('#modified')
+        repo.invalidate()
+        assert repo.tag_counts() == {'one': 1, 'two': 1}
+        (notes / 'dir' / 'three.md').write_text('#three')
+        (notes / 'two.md').unlink()
+        repo.invalidate()
+        assert repo.tag_counts() == {'modified': 1, 'three': 1}
+
+        repo.conf.unchanged_dir_check_interval = 0
+        (notes / 'dir' / 'three.md').write_text('#three-modified')
+        repo.invalidate()
+        assert repo.tag_counts() == {'modified': 1, 'three-modified': 1}
+        assert {p for p, in repo.connection.execute('SELECT path FROM dirs')} == {str(notes), str(notes / 'dir')}
+
+
+def test_skip_unchanged_dirs_recent_mtime(tmp_path):
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'one.md').write_text('#one')
+    conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / 'cache.sqlite3'),
+                          skip_unchanged_dirs=True)
+    with conf.instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1}
+        # simulate a file being created after the directory was listed, within the same mtime tick
+        mtime = os.stat(notes).st_mtime
+        (notes / 'two.md').write_text('#two')
+        os.utime(notes, (mtime, mtime))
+        repo.invalidate()
+        assert repo.tag_counts() == {'one': 1, 'two': 1}
+
+
+def test_content_digests(fs, mocker):
+    fs.create_file('/notes/one.md', contents='#one')
+    fs.create_file('/notes/two.md', contents='#two')
+    conf = config()
+    conf.content_digests = True
+    repo = conf.instantiate()
+    parse = mocker.patch('notesdir.repos.sqlite._parse_file', wraps=sqlite._parse_file)
+    assert repo.tag_counts() == {'one': 1, 'two': 1}
+    assert parse.call_count == 2
+
+    parse.reset_mock()
+    os.utime('/notes/one.md', (1000, 1000))
+    Path('/notes/two.md').write_text('#owt')
+    repo.invalidate()
+    assert repo.tag_counts() == {'one': 1, 'owt': 1}
+    assert [c.args[1] for c in parse.call_args_list] == ['/notes/two.md']
+    assert repo.connection.execute('SELECT stat_mtime FROM files WHERE path = ?', ('/notes/one.md',)).fetchone() \
+        == (1000,)
+
+    parse.reset_mock()
+    repo.invalidate()
+    assert repo.tag_counts() == {'one': 1, 'owt': 1}
+    assert not parse.called
+
+
+def test_schema_version(tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite3')
+    connection = sqlite3.connect(cache_path)
+    connection.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT)')
+    connection.commit()
+    connection.close()
+    (tmp_path / 'one.md').write_text('#one')
+    with SqliteRepoConf(root_paths={str(tmp_path)}, cache_path=cache_path).instantiate() as repo:
+        assert repo.tag_counts() == {'one': 1}
+
+
+def test_search(fs):
+    fs.create_file('/notes/one.md', contents='---\ntitle: Donuts\n...\nI like ice cream. #food')
+    fs.create_file('/notes/two.md', contents='Cream, ice, and donuts! Donuts are great. #food')
+    fs.create_file('/notes/three.html', contents='<html><body>Ice-cream <b>donuts</b></body></html>')
+    fs.create_file('/notes/four.md', contents='Nothing to see here.')
+    repo = config().instantiate()
+    paths = {i.path for i in repo.query(FileQuery.parse('text:DONUTS'))}
+    assert paths == {'/notes/one.md', '/notes/two.md', '/notes/three.html'}
+    paths = {i.path for i in repo.query(FileQuery.parse('text:ice+cream text:donuts'))}
+    assert paths == {'/notes/one.md', '/notes/three.html'}
+    assert not list(repo.query(FileQuery.parse('text:ice+donuts')))
+    assert not list(repo.query(FileQuery.parse('text:donut')))
+    assert repo.tag_counts(FileQuery.parse('text:cream')) == {'food': 2}
+    assert [i.path for i in repo.query(FileQuery.parse('text:donuts sort:-filename'))] == \
+           ['/notes/two.md', '/notes/three.html', '/notes/one.md']
+
+    results = list(repo.search(FileQuery.parse('text:ice tag:food'), FileInfoReq(path=True, title=True)))
+    assert [(i.path, i.title) for i, _ in results] == [('/notes/one.md', 'Donuts'), ('/notes/two.md', None)]
+    assert results[0][1] == 'I like **ice** cream. #food'
+
+    Path('/notes/four.md').write_text('Donuts donuts donuts donuts.')
+    Path('/notes/two.md').unlink()
+    repo.invalidate()
+    assert [i.path for i in repo.query('text:donuts')][0] == '/notes/four.md'
+    assert {i.path for i in repo.query('text:cream')} == {'/notes/one.md', '/notes/three.html'}
+
+
+def test_referents_resolved_once(fs, mocker):
+    fs.create_file('/notes/one.md', contents='[a](three.md) [b](three.md#heading) [c](#top)')
+    fs.create_file('/notes/two.md', contents='[a](three.md) [c](#top)')
+    fs.create_file('/notes/three.md', contents='Hello')
+    repo = config().instantiate()
+    realpath = mocker.spy(os.path, 'realpath')
+    repo.invalidate()
+    assert {i.path for i in repo.query('', FileInfoReq(path=True))}
+    realpath.reset_mock()
+    infos = {i.path: i for i in repo.query('', FileInfoReq(path=True, links=True, backlinks=True))}
+    assert [link.referent() for link in infos['/notes/one.md'].links] == \
+           ['/notes/one.md', '/notes/three.md', '/notes/three.md']
+    assert [link.referent() for link in infos['/notes/three.md'].backlinks] == ['/notes/three.md'] * 3
+    assert not realpath.called
+
+    Path('/notes/one.md').touch()
+    Path('/notes/two.md').write_text('[a](three.md) [c](#top) ')
+    repo.invalidate()
+    repo.tag_counts()
+    # each distinct href is only resolved once for both files, and "#top" does not need resolving
+    assert [c.args[0] for c in realpath.call_args_list] == ['/notes/one.md/../three.md'] * 2
+
+
+def test_refresh_missing_files(fs):
+    for i in range(30):
+        fs.create_file(f'/notes/dir/{i}.md', contents=f'#tag [next]({i + 1}.md) [out](../outside.md)')
+    fs.create_file('/notes/keep.md', contents='[five](dir/5.md)')
+    repo = config().instantiate()
+    assert repo.tag_counts() == {'tag': 30}
+    for i in range(30):
+        Path(f'/notes/dir/{i}.md').unlink()
+    statements = []
+    repo.connection.set_trace_callback(statements.append)
+    repo.invalidate()
+    assert repo.tag_counts() == {}
+    assert len([s for s in statements if 'missing_ids' in s and not s.startswith('INSERT')]) == 6
+    assert repo.connection.execute('SELECT path, existent FROM files ORDER BY path').fetchall() == [
+        ('/notes/dir/5.md', False),
+        ('/notes/keep.md', True)
+    ]
+    assert not repo.connection.execute('SELECT * FROM missing_ids').fetchall()
+
+
 def test_tag_counts(fs):
     fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2')
     fs.create_file('/notes/two.md', contents='#tag1 #tag3')
@@ -130,6 +542,29 @@ def test_change(fs):
     assert repo.info('bar', FileInfoReq.full()) == FileInfo('/notes/bar', backlinks=[LinkInfo(path2, 'bar')])
 
 
+def test_change_updates_cache_directly(fs, mocker):
+    fs.create_file('/notes/one.md', contents='[1](two.md)')
+    fs.create_file('/notes/two.md', contents='#two')
+    fs.create_file('/notes/dir/three.md', contents='[3](../two.md)')
+    repo = config().instantiate()
+    repo.tag_counts()
+    spy = mocker.spy(repo, '_refresh')
+    repo.change([AddTagCmd('/notes/one.md', 'new'),
+                 MoveCmd('/notes/dir', '/notes/moved'),
+                 MoveCmd('/notes/two.md', '/notes/renamed.md')])
+    assert repo.tag_counts() == {'new': 1, 'two': 1}
+    assert [i.path for i in repo.query('sort:path')] == [
+        '/notes/moved/three.md', '/notes/one.md', '/notes/renamed.md']
+    assert repo.info('/notes/two.md', 'backlinks').backlinks == [
+        LinkInfo('/notes/moved/three.md', '../two.md'), LinkInfo('/notes/one.md', 'two.md')]
+    assert not spy.called
+
+    # no edits means nothing to refresh, rather than the whole cache
+    repo.change([])
+    assert repo.tag_counts() == {'new': 1, 'two': 1}
+    assert not spy.called
+
+
 def test_ignore(fs):
     path1 = '/notes/one.md'
     path2 = '/notes/.two.md'
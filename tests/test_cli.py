@@ -4,7 +4,7 @@ import itertools
 from pathlib import Path
 from freezegun import freeze_time
 from notesdir import cli
-from notesdir.models import FileInfo, CreateCmd, ReplaceHrefCmd, MoveCmd, AddTagCmd, DelTagCmd, SetTitleCmd,\
+from notesdir.models import FileInfo, CreateCmd, ReplaceHrefsCmd, MoveCmd, AddTagCmd, DelTagCmd, SetTitleCmd,\
     SetCreatedCmd
 
 
@@ -154,7 +154,7 @@ def test_mv_file(fs, capsys):
     assert Path('/notes/cwd/subdir/old.md').exists()
     assert Path('/notes/dir/referrer.md').read_text() == 'I have a [link](../cwd/subdir/old.md).'
     out, err = capsys.readouterr()
-    assert out == (str(ReplaceHrefCmd('/notes/dir/referrer.md', '../cwd/subdir/old.md', 'new.md')) + '\n'
+    assert out == (str(ReplaceHrefsCmd('/notes/dir/referrer.md', {'../cwd/subdir/old.md': 'new.md'})) + '\n'
                    + str(MoveCmd('/notes/cwd/subdir/old.md', '/notes/dir/new.md')) + '\n')
 
     assert cli.main(['mv', 'subdir/old.md', '../dir/new.md']) == 0
@@ -242,7 +242,7 @@ conf.path_organizer = lambda info: info.path.replace('hi', 'hello')
     assert path3.exists()
     assert not path4.exists()
     out, err = capsys.readouterr()
-    assert out == (str(ReplaceHrefCmd(str(path2), 'hi.md', 'hello.md')) + '\n'
+    assert out == (str(ReplaceHrefsCmd(str(path2), {'hi.md': 'hello.md'})) + '\n'
                    + str(MoveCmd(str(path3), str(path4), create_parents=True, delete_empty_parents=True)) + '\n')
     assert cli.main(['organize', '-j']) == 0
     assert path1.is_file()
@@ -427,6 +427,43 @@ This is a test doc."""
     out, err = capsys.readouterr()
     assert out
 
+    assert cli.main(['query', '-j', '-f', 'path,tags']) == 0
+    out, err = capsys.readouterr()
+    assert json.loads(out) == [{'path': path1, 'tags': ['cool', 'has space']}, {'path': path2, 'tags': ['test']}]
+    assert cli.main(['query', '--ndjson', 'sort:-path']) == 0
+    out, err = capsys.readouterr()
+    assert [json.loads(line) for line in out.splitlines()] == [FileInfo(path=path2, tags=['test']).as_json(), expected1]
+
+
+def test_search(fs, capsys):
+    nd_setup(fs)
+    fs.create_file('/notes/one.md', contents='---\ntitle: Treats\n...\nI like ice cream.')
+    fs.create_file('/notes/two.md', contents='I like #donuts.')
+    assert cli.main(['search', 'like', '-j']) == 0
+    out, err = capsys.readouterr()
+    assert {r['path'] for r in json.loads(out)} == {'/notes/one.md', '/notes/two.md'}
+    assert cli.main(['search', 'ice cream', '-q', 'limit:5']) == 0
+    out, err = capsys.readouterr()
+    assert out == '--------------------\npath: /notes/one.md\ntitle: Treats\nI like **ice cream**.\n'
+
+
+def test_index(fs, capsys):
+    nd_setup(fs)
+    fs.create_file('/notes/one.md', contents='#tag')
+    assert cli.main(['index']) == 0
+    assert cli.main(['index', '--rebuild']) == 0
+    out, err = capsys.readouterr()
+    assert not out
+
+
+def test_no_refresh(fs, capsys):
+    nd_setup(fs)
+    fs.create_file('/notes/one.md', contents='#tag')
+    assert cli.main(['tags', '--no-refresh', '-j']) == 0
+    out, err = capsys.readouterr()
+    # an in-memory cache has never been built before, so it is refreshed anyway
+    assert json.loads(out) == {'tag': 1}
+
 
 def test_relink(fs, capsys):
     nd_setup(fs)
@@ -434,7 +471,7 @@ def test_relink(fs, capsys):
     fs.create_file(path1, contents='I link to [bar](/notes/subdir1/bar.md#section)')
     assert cli.main(['relink', '-p', '/notes/subdir1/bar.md', '/blah/baz.md']) == 0
     out, err = capsys.readouterr()
-    assert out == str(ReplaceHrefCmd(str(path1), '/notes/subdir1/bar.md#section', '../blah/baz.md#section')) + '\n'
+    assert out == str(ReplaceHrefsCmd(str(path1), {'/notes/subdir1/bar.md#section': '../blah/baz.md#section'})) + '\n'
     assert cli.main(['relink', '/notes/subdir1/bar.md', '/blah/baz.md']) == 0
     assert path1.read_text() == 'I link to [bar](../blah/baz.md#section)'
 
@@ -1,4 +1,6 @@
-from notesdir.conf import default_ignore, resource_path_fn, rewrite_name_using_title
+import os
+
+from notesdir.conf import default_ignore, resource_path_fn, rewrite_name_using_title, SqliteRepoConf
 from notesdir.models import FileInfo
 
 
@@ -48,3 +50,16 @@ def test_rewrite_name_using_title():
     assert (call('/notes/blah.md', '01234567890123456789012345678901234567890123456789012345678901234567')
             == '/notes/012345678901234567890123456789012345678901234567890123456789.md')
     assert call('/notes/blah.md', 'hi 😀 love you') == '/notes/hi-love-you.md'
+
+
+def test_sqlite_standardize_cache_path(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('HOME', '/home/someone')
+
+    def standardized(cache_path):
+        return SqliteRepoConf(root_paths={'.'}, cache_path=cache_path).standardize()
+
+    assert standardized('cache.sqlite3').cache_path == str(tmp_path / 'cache.sqlite3')
+    assert standardized('~/cache.sqlite3').cache_path == '/home/someone/cache.sqlite3'
+    assert standardized(':memory:').cache_path == ':memory:'
+    assert standardized(':memory:').root_paths == {os.path.realpath(tmp_path)}
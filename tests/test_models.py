@@ -1,6 +1,7 @@
 from datetime import datetime
 import os.path
 from freezegun import freeze_time
+import pytest
 
 from notesdir.models import FileQuery, FileInfoReq, LinkInfo, FileQuerySort, FileQuerySortField, FileInfo
 
@@ -53,6 +54,23 @@ def test_referent_self():
     assert LinkInfo('/foo/bar', '#baz').referent() == '/foo/bar'
 
 
+def test_referent_cached(mocker):
+    realpath = mocker.spy(os.path, 'realpath')
+    link = LinkInfo('/foo/bar', 'baz')
+    assert link.referent() == '/foo/baz'
+    assert link.referent() == '/foo/baz'
+    assert realpath.call_count == 1
+    assert link == LinkInfo('/foo/bar', 'baz')
+
+
+def test_referent_resolved(mocker):
+    realpath = mocker.spy(os.path, 'realpath')
+    link = LinkInfo.resolved('/foo/bar', 'baz', '/elsewhere/baz')
+    assert link.referent() == '/elsewhere/baz'
+    assert LinkInfo.resolved('/foo/bar', 'http://example.com', None).referent() is None
+    assert not realpath.called
+
+
 @freeze_time('2012-02-03T04:05:06Z')
 def test_guess_created(fs):
     info = FileInfo('foo')
@@ -73,6 +91,27 @@ def test_parse_query():
     assert FileQuery.parse(strquery) == expected
 
 
+def test_parse_query_limit_offset():
+    assert FileQuery.parse('limit:20 offset:40') == FileQuery(limit=20, offset=40)
+    assert FileQuery.parse('limit:0 offset:0') == FileQuery(limit=0, offset=0)
+    with pytest.raises(ValueError):
+        FileQuery.parse('limit:-1')
+    with pytest.raises(ValueError):
+        FileQuery.parse('offset:-1')
+
+
+def test_parse_query_text():
+    assert FileQuery.parse('text:Donuts text:ice+cream') == FileQuery(include_text=['Donuts', 'ice cream'])
+
+
+def test_apply_limit():
+    data = [FileInfo(str(i)) for i in range(5)]
+    assert list(FileQuery().apply_limit(data)) == data
+    assert list(FileQuery(limit=2).apply_limit(data)) == data[:2]
+    assert list(FileQuery(offset=3).apply_limit(data)) == data[3:]
+    assert list(FileQuery(limit=2, offset=2).apply_limit(data)) == data[2:4]
+
+
 def test_apply_sorting():
     data = [
         FileInfo('/a/one', tags={'baz'},
@@ -118,3 +157,11 @@ def test_parse_info_req():
     assert FileInfoReq.parse('path,backlinks') == expected
     assert FileInfoReq.parse(['path', 'backlinks']) == expected
     assert FileInfoReq.parse(expected) == expected
+
+
+def test_file_info_as_json_fields():
+    info = FileInfo('/foo.md', title='Foo', tags={'b', 'a'}, links=[LinkInfo('/foo.md', 'bar.md')])
+    assert info.as_json('path,tags') == {'path': '/foo.md', 'tags': ['a', 'b']}
+    assert info.as_json() == {'path': '/foo.md', 'title': 'Foo', 'created': None, 'tags': ['a', 'b'],
+                              'links': [{'referrer': '/foo.md', 'href': 'bar.md', 'referent': '/bar.md'}],
+                              'backlinks': []}
@@ -4,6 +4,7 @@ from urllib.parse import urlparse
 import pytest
 
 from notesdir.conf import DirectRepoConf
+from notesdir.models import MoveCmd, ReplaceHrefsCmd
 from notesdir.rearrange import href_path, path_as_href, edits_for_rearrange
 
 
@@ -243,3 +244,25 @@ def test_rearrange_absolute_paths(fs):
     assert Path(paths[2]).read_text() == 'I am not being moved but link to something that [is](newdir/new1.md)'
     assert Path('/notes/newdir/new4.md').read_text() == 'I am being moved and so is what I link [to](new1.md)'
     assert Path('/notes/newdir/new1.md').read_text() == docs[0]
+
+
+def test_rearrange_groups_edits_by_referrer(fs):
+    fs.create_file('/notes/hub.md', contents='[one](one.md) [two](two.md) [one again](one.md#sec) [other](other.md)')
+    fs.create_file('/notes/one.md', contents='[two](two.md)')
+    fs.create_file('/notes/two.md')
+    fs.create_dir('/notes/dir')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    edits = list(edits_for_rearrange(repo, {
+        '/notes/one.md': '/notes/dir/one.md',
+        '/notes/two.md': '/notes/dir/two.md'
+    }))
+    assert edits == [
+        ReplaceHrefsCmd('/notes/hub.md', {'one.md': 'dir/one.md', 'one.md#sec': 'dir/one.md#sec',
+                                          'two.md': 'dir/two.md'}),
+        MoveCmd('/notes/one.md', '/notes/dir/one.md'),
+        MoveCmd('/notes/two.md', '/notes/dir/two.md'),
+    ]
+    repo.change(edits)
+    assert Path('/notes/hub.md').read_text() == ('[one](dir/one.md) [two](dir/two.md) [one again](dir/one.md#sec) '
+                                                 '[other](other.md)')
+    assert Path('/notes/dir/one.md').read_text() == '[two](two.md)'
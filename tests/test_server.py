@@ -0,0 +1,118 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from notesdir import cli
+from notesdir.conf import DirectRepoConf, NotesdirConf, SqliteRepoConf
+from notesdir.server import forward, serve
+
+
+def _wait_for(path: str):
+    deadline = time.time() + 10
+    while not os.path.exists(path):
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_serve(tmp_path, monkeypatch):
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'one.md').write_text('#tag1')
+    conf = NotesdirConf(repo_conf=SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / 'cache.sqlite3')))
+    socket_path = str(tmp_path / 'sock')
+    stopped = threading.Event()
+
+    def run():
+        with conf.instantiate() as nd:
+            serve(socket_path, lambda argv: cli._run_forwarded(nd, argv), stop=stopped.is_set)
+
+    assert forward(['tags'], socket_path) is None
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        _wait_for(socket_path)
+        exit_code, out, err = forward(['tags', '-j'], socket_path)
+        assert exit_code == 0
+        assert json.loads(out) == {'tag1': 1}
+
+        # changes made by other processes are seen, and relative paths are resolved against the client's cwd
+        (notes / 'two.md').write_text('#tag2')
+        monkeypatch.chdir(notes)
+        exit_code, out, err = forward(['info', '-j', 'two.md'], socket_path)
+        assert exit_code == 0
+        assert json.loads(out)['tags'] == ['tag2']
+
+        exit_code, out, err = forward(['change', '-t', 'Two', 'two.md'], socket_path)
+        assert exit_code == 0
+        assert (notes / 'two.md').read_text() == '---\ntitle: Two\n---\n\n#tag2'
+
+        assert forward(['watch'], socket_path) == (1, '', 'This command cannot be run by the server.\n')
+        exit_code, out, err = forward(['nonsense'], socket_path)
+        assert exit_code == 2
+        assert 'invalid choice' in err
+        exit_code, out, err = forward(['info', '-f', 'nonsense', 'two.md'], socket_path)
+        assert exit_code == 1
+        assert 'Traceback' in err
+
+        # connections that send nothing, such as another server checking whether this one is running, are harmless
+        with pytest.raises(FileExistsError):
+            serve(socket_path, lambda argv: 0)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(socket_path)
+        assert forward(['tags', '-j'], socket_path)[0] == 0
+
+        monkeypatch.setenv('NOTESDIR_SOCKET', socket_path)
+        assert cli.main(['tags', '-j']) == 0
+    finally:
+        stopped.set()
+        thread.join()
+    assert not os.path.exists(socket_path)
+
+
+def test_serve_stale_path(tmp_path):
+    # a socket left behind by a server that was killed is replaced
+    socket_path = str(tmp_path / 'sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(socket_path)
+    serve(socket_path, lambda argv: 0, stop=lambda: True)
+    assert not os.path.exists(socket_path)
+
+    # anything else is left alone
+    file_path = tmp_path / 'file'
+    file_path.write_text('not a socket')
+    with pytest.raises(FileExistsError):
+        serve(str(file_path), lambda argv: 0, stop=lambda: True)
+    assert file_path.read_text() == 'not a socket'
+
+
+def test_serve_direct_repo(tmp_path):
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'a.md').write_text('A')
+    conf = NotesdirConf(repo_conf=DirectRepoConf(root_paths={str(notes)}))
+    socket_path = str(tmp_path / 'sock')
+    stopped = threading.Event()
+
+    def run():
+        with conf.instantiate() as nd:
+            serve(socket_path, lambda argv: cli._run_forwarded(nd, argv), stop=stopped.is_set)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        _wait_for(socket_path)
+        args = ['info', '-j', '-f', 'backlinks', str(notes / 'a.md')]
+        exit_code, out, err = forward(args, socket_path)
+        assert json.loads(out)['backlinks'] == []
+
+        # the backlinks index kept by the server's repo is rebuilt for each command
+        (notes / 'b.md').write_text('[a](a.md)')
+        exit_code, out, err = forward(args, socket_path)
+        assert [link['referrer'] for link in json.loads(out)['backlinks']] == [str(notes / 'b.md')]
+    finally:
+        stopped.set()
+        thread.join()
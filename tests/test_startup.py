@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+from notesdir.conf import SqliteRepoConf
+
+# Cumulative microseconds that importing notesdir.cli may take, as reported by `python -X importtime`.
+# This is several times what it takes on a typical machine, so that only significant regressions fail the test.
+IMPORT_BUDGET_US = 250_000
+
+# Modules that read-only commands should not need when the cache is up to date.
+HEAVY_MODULES = {'bs4', 'lxml', 'PyPDF4', 'mako', 'yaml', 'shortuuid', 'terminaltables'}
+
+
+def _imports(args, env) -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'notesdir'] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative_by_name = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                cumulative_by_name[name.strip()] = int(cumulative)
+    return cumulative_by_name
+
+
+def test_read_only_startup(tmp_path):
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'one.md').write_text('---\ntitle: One\n---\n#tag')
+    (notes / 'two.html').write_text('<html><head><meta name="keywords" content="tag"></head></html>')
+    cache_path = str(tmp_path / 'cache.sqlite3')
+    (tmp_path / '.notesdir.conf.py').write_text(f"""
+from notesdir.conf import *
+conf = NotesdirConf(repo_conf=SqliteRepoConf(root_paths={{{str(notes)!r}}}, cache_path={cache_path!r}))
+""")
+    with SqliteRepoConf(root_paths={str(notes)}, cache_path=cache_path).instantiate() as repo:
+        repo.refresh()
+    env = dict(os.environ, HOME=str(tmp_path), NOTESDIR_SOCKET=str(tmp_path / 'missing.sock'))
+
+    for args in (['tags', '-j'], ['query', '-j', 'tag:tag'], ['info', '-j', str(notes / 'one.md')]):
+        imports = _imports(args, env)
+        assert not HEAVY_MODULES.intersection(name.split('.')[0] for name in imports)
+        assert imports['notesdir.cli'] < IMPORT_BUDGET_US
@@ -0,0 +1,88 @@
+import math
+import sys
+import threading
+import time
+from typing import Any, Callable
+import pytest
+from notesdir.conf import SqliteRepoConf
+from notesdir.repos.sqlite import SqliteRepo
+from notesdir.watch import Coalescer, watch
+
+
+def test_coalescer():
+    coalescer = Coalescer(debounce=1, max_delay=5)
+    assert coalescer.timeout(100) is None
+    assert coalescer.take(100) is None
+
+    coalescer.add('/notes/one.md', 100)
+    coalescer.add('/notes/two.md', 100.5)
+    assert coalescer.timeout(100.5) == 1
+    assert coalescer.take(101) is None
+    assert coalescer.take(101.5) == ({'/notes/one.md', '/notes/two.md'}, False)
+    assert coalescer.timeout(101.5) is None
+
+    for i in range(10):
+        coalescer.add('/notes/one.md', 200 + i * 0.75)
+        if i == 3:
+            coalescer.add(None, 200 + i * 0.75)
+    assert coalescer.take(204.9) is None
+    assert coalescer.take(205) == ({'/notes/one.md'}, True)
+
+
+def _wait_for(conf: SqliteRepoConf, fn: Callable[[SqliteRepo], Any], expected: Any) -> Any:
+    deadline = time.time() + 10
+    while True:
+        with conf.instantiate() as repo:
+            result = fn(repo)
+        if result == expected or time.time() > deadline:
+            return result
+        time.sleep(0.05)
+
+
+def _count_tags(conf: SqliteRepoConf, expected: dict) -> dict:
+    return _wait_for(conf, lambda repo: repo.tag_counts(), expected)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify fallback is only available on Linux')
+def test_watch(tmp_path, mocker):
+    mocker.patch('notesdir.watch._IDLE_INTERVAL', 0.1)
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'one.md').write_text('#one')
+    conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=str(tmp_path / 'cache.sqlite3'))
+    stopped = threading.Event()
+
+    def run():
+        with conf.instantiate() as repo:
+            watch(repo, debounce=0.05, max_delay=1, stop=stopped.is_set)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        reader_conf = SqliteRepoConf(root_paths={str(notes)}, cache_path=conf.cache_path, max_staleness=math.inf)
+        assert _count_tags(reader_conf, {'one': 1}) == {'one': 1}
+        (notes / 'two.md').write_text('#two')
+        (notes / 'sub').mkdir()
+        (notes / 'sub' / 'three.md').write_text('#three')
+        assert _count_tags(reader_conf, {'one': 1, 'two': 1, 'three': 1}) == {'one': 1, 'two': 1, 'three': 1}
+        (notes / 'one.md').unlink()
+        (notes / 'sub' / 'three.md').write_text('#four')
+        assert _count_tags(reader_conf, {'two': 1, 'four': 1}) == {'two': 1, 'four': 1}
+
+        # a file that cannot be parsed does not stop the watcher, and is picked up once it is fixed
+        (notes / 'five.md').write_text('---\ntitle: [unclosed\n---\n#five')
+        time.sleep(0.5)
+        (notes / 'five.md').write_text('---\ntitle: closed\n---\n#five')
+        assert _count_tags(reader_conf, {'two': 1, 'four': 1, 'five': 1}) == {'two': 1, 'four': 1, 'five': 1}
+
+        # once idle, the watcher records that the cache is up to date
+        changed = time.time()
+        assert _wait_for(reader_conf, lambda repo: repo._refresh_started() > changed - 1, True)
+    finally:
+        stopped.set()
+        thread.join()
+
+    with SqliteRepoConf(root_paths={str(notes)}, cache_path=conf.cache_path, max_staleness=10).instantiate() as repo:
+        spy = mocker.spy(repo, '_refresh')
+        assert repo.tag_counts() == {'two': 1, 'four': 1, 'five': 1}
+        assert not spy.called